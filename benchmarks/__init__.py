@@ -0,0 +1,15 @@
+"""
+Offline benchmarks, run from the root of the repository with e.g. `python -m benchmarks.embed_render`
+"""
+import importlib.util
+import sys
+from os.path import dirname, join
+
+# Fall back on the example configuration so that the benchmarks don't need a deployment
+try:
+    import config
+except ImportError:
+    _spec = importlib.util.spec_from_file_location("config", join(dirname(dirname(__file__)), "config.example.py"))
+    config = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(config)
+    sys.modules["config"] = config
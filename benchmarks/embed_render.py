@@ -0,0 +1,44 @@
+"""
+Compares the cost of an update of the check-in counter, rendering the whole embed versus the cached EventEmbed
+"""
+# Variables
+from benchmarks import config
+
+# Custom modules
+import tools
+from event_index import EventRecord
+
+import argparse
+import time
+import timeit
+
+CALENDAR_DATA = {
+    "embed": {
+        "color": "0xeeb948",
+        "thumbnail": "https://domain.tld/image.png"
+    }
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks the rendering of event embeds")
+    parser.add_argument("-n", "--number", default=10000, type=int, help="the number of updates to render")
+    args = parser.parse_args()
+
+    now = time.time()
+    event = EventRecord("uid", "Algorithmique", "E201", now, now + 2 * 60 * 60)
+    event_embed = tools.EventEmbed(event, CALENDAR_DATA)
+
+    timings = {
+        "before (generate_event_embed)": timeit.timeit(
+            lambda: tools.generate_event_embed(event, (12, 30), CALENDAR_DATA), number=args.number),
+        "after (EventEmbed.render)": timeit.timeit(
+            lambda: event_embed.render((12, 30)), number=args.number)
+    }
+    print(f"Timezone: {config.TIMEZONE}, {args.number} updates")
+    for name, total in timings.items():
+        print(f"{name:32} {total / args.number * 1e6:8.2f} µs/update")
+
+
+if __name__ == '__main__':
+    main()
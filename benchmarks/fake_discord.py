@@ -0,0 +1,139 @@
+"""
+In-process stand-ins for the parts of Discord used by the calendar cog, with a configurable latency for each API call
+"""
+# Variables
+from benchmarks import config
+
+import asyncio
+import itertools
+import random
+import time
+import types
+import typing
+
+_ids = itertools.count(1000)
+
+
+class FakeRole:
+    def __init__(self, _id: int):
+        self.id = _id
+        self.mention = f"<@&{_id}>"
+
+
+class FakeGuild:
+    def get_role(self, _id: int) -> FakeRole:
+        return FakeRole(_id)
+
+
+class FakeMessage:
+    def __init__(self, channel: "FakeChannel", content: str, embed):
+        self.id = next(_ids)
+        self.channel = channel
+        self.content = content
+        self.embed = embed
+        self.edits = 0
+        self.reactions: typing.List[str] = list()
+
+    async def edit(self, content: str = None, embed=None) -> None:
+        await asyncio.sleep(self.channel.latency)
+        self.content, self.embed = content, embed
+        self.edits += 1
+
+    async def add_reaction(self, emoji: str) -> None:
+        await asyncio.sleep(self.channel.latency)
+        self.reactions.append(emoji)
+
+
+class FakeChannel:
+    def __init__(self, _id: int, latency: float):
+        self.id = _id
+        self.name = f"channel-{_id}"
+        self.guild = FakeGuild()
+        self.latency = latency
+        self.messages: typing.Dict[int, FakeMessage] = dict()
+
+    async def send(self, content: str = None, embed=None) -> FakeMessage:
+        await asyncio.sleep(self.latency)
+        message = FakeMessage(self, content, embed)
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, _id: int) -> FakeMessage:
+        await asyncio.sleep(self.latency)
+        return self.messages[_id]
+
+
+class FakeUser:
+    def __init__(self, _id: int, latency: float):
+        self.id = _id
+        self.name = self.display_name = f"user-{_id}"
+        self.latency = latency
+        # When each DM was received, as a time.perf_counter() timestamp
+        self.dms: typing.List[float] = list()
+
+    async def send(self, content: str = None) -> None:
+        await asyncio.sleep(self.latency)
+        self.dms.append(time.perf_counter())
+
+
+class FakeBot:
+    """
+    Only what the cog uses: the loop, its own user and the channel and user lookups, which are all cached
+    """
+    def __init__(self, latency: float):
+        self.loop = asyncio.get_event_loop()
+        self.latency = latency
+        self.user = FakeUser(next(_ids), latency)
+        self.channels: typing.Dict[int, FakeChannel] = dict()
+        self.users: typing.Dict[int, FakeUser] = dict()
+
+    def get_channel(self, _id: int) -> FakeChannel:
+        if _id not in self.channels:
+            self.channels[_id] = FakeChannel(_id, self.latency)
+        return self.channels[_id]
+
+    def get_user(self, _id: int) -> FakeUser:
+        if _id not in self.users:
+            self.users[_id] = FakeUser(_id, self.latency)
+        return self.users[_id]
+
+    async def fetch_user(self, _id: int) -> FakeUser:
+        await asyncio.sleep(self.latency)
+        return self.get_user(_id)
+
+
+class FakeGateway:
+    """
+    Fires the reactions of the students to the messages of their sessions at a fixed rate,
+    the way discord.py dispatches them: each in its own task
+    """
+    def __init__(self, bot: FakeBot, cog):
+        """
+
+        :param bot: The fake bot
+        :param cog: The calendar cog the reactions are dispatched to
+        """
+        self.bot = bot
+        self.cog = cog
+        # user_id : when the reaction was dispatched, as a time.perf_counter() timestamp
+        self.dispatched: typing.Dict[int, float] = dict()
+
+    async def run(self, rate: float, reactions: typing.List[typing.Tuple[int, int]]) -> None:
+        """
+        Dispatches the reactions in a random order
+        :param rate: The number of reactions per second
+        :param reactions: The (user id, message id) pairs to dispatch
+        :return: None
+        """
+        reactions = list(reactions)
+        random.shuffle(reactions)
+        start = time.perf_counter()
+        for i, (user_id, message_id) in enumerate(reactions):
+            # Catch up on the schedule rather than sleeping once per reaction
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            payload = types.SimpleNamespace(message_id=message_id, user_id=user_id,
+                                            emoji=config.REACTION_EMOJI, member=None)
+            self.dispatched[user_id] = time.perf_counter()
+            self.bot.loop.create_task(self.cog.on_raw_reaction_add(payload))
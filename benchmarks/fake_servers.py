@@ -0,0 +1,131 @@
+"""
+A local HTTP server serving synthetic calendars and mocking the courses and check-in API
+"""
+# Variables
+from benchmarks import config
+
+from aiohttp import web
+import arrow
+import asyncio
+import hashlib
+import json
+import random
+import time
+import typing
+
+# The daily slots of the synthetic courses, in config.TIMEZONE
+SLOTS = ((8, 0, 10, 0), (10, 15, 12, 15), (13, 30, 15, 30), (15, 45, 17, 45))
+
+
+def _format(ts: float) -> str:
+    return time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(ts))
+
+
+def generate_calendar(cal_id: str, live_begin: float, live_end: float, days: int = 365, tracks: int = 1) -> str:
+    """
+    Generates the feed of a calendar with courses on weekdays, half a year before and after today,
+    plus the live events the load test reacts to
+    :param cal_id: The id of the calendar
+    :param live_begin: The epoch timestamp of the beginning of the live events
+    :param live_end: The epoch timestamp of the end of the live events
+    :param days: The number of days of the calendar
+    :param tracks: The number of live events, happening at the same time
+    :return: The feed
+    """
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//benchmarks//fake calendar//EN"]
+
+    def add(uid: str, name: str, location: str, begin: float, end: float) -> None:
+        lines.extend(("BEGIN:VEVENT", f"UID:{uid}", f"DTSTAMP:{_format(begin)}", f"DTSTART:{_format(begin)}",
+                      f"DTEND:{_format(end)}", f"SUMMARY:{name}", f"LOCATION:{location}", "END:VEVENT"))
+
+    first_day = arrow.now(config.TIMEZONE).floor("day").shift(days=-days // 2)
+    for d in range(days):
+        day = first_day.shift(days=d)
+        if day.weekday() >= 5:
+            continue
+        for i, (begin_h, begin_m, end_h, end_m) in enumerate(SLOTS):
+            begin = day.replace(hour=begin_h, minute=begin_m).timestamp()
+            end = day.replace(hour=end_h, minute=end_m).timestamp()
+            # Only the live events are happening during the test
+            if begin < live_end and end > live_begin:
+                continue
+            add(f"{cal_id}-{d}-{i}", f"Cours {i}", f"E{100 + i}", begin, end)
+    for track in range(tracks):
+        add(f"{cal_id}-live-{track}", f"Live {track}", f"Amphi {track}", live_begin, live_end)
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(lines) + "\r\n"
+
+
+class FakeServers:
+    """
+    Serves the calendars under /calendars/<id>.ics with ETags, /courses, /check-in and /check-in/batch,
+    the API answering after a random latency and failing with a 503 at the given rate
+    """
+    def __init__(self, calendars: typing.Dict[str, str], course: dict, latency: float, failure_rate: float):
+        """
+
+        :param calendars: calendar_id : feed
+        :param course: The only course of the day
+        :param latency: The average latency of the API, in seconds
+        :param failure_rate: The probability of a request to the API to fail
+        """
+        self.calendars = {cal_id: (feed, hashlib.sha1(feed.encode("utf-8")).hexdigest())
+                          for cal_id, feed in calendars.items()}
+        self.course = course
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests: typing.Dict[str, int] = {"calendars": 0, "courses": 0, "check_in": 0, "failed": 0}
+        self._runner: typing.Union[web.AppRunner, None] = None
+
+    async def _api_delay(self) -> bool:
+        """
+        :return: Whether or not the request fails
+        """
+        await asyncio.sleep(random.expovariate(1 / self.latency) if self.latency else 0)
+        if random.random() < self.failure_rate:
+            self.requests["failed"] += 1
+            return True
+        return False
+
+    async def _calendar(self, request: web.Request) -> web.Response:
+        self.requests["calendars"] += 1
+        cal_id = request.match_info["cal_id"]
+        if cal_id not in self.calendars:
+            return web.Response(status=404)
+        feed, etag = self.calendars[cal_id]
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304)
+        return web.Response(text=feed, content_type="text/calendar", headers={"ETag": etag})
+
+    async def _courses(self, request: web.Request) -> web.Response:
+        self.requests["courses"] += 1
+        if await self._api_delay():
+            return web.Response(status=503)
+        return web.json_response({"success": True, "courses": [self.course]})
+
+    async def _check_in(self, request: web.Request) -> web.Response:
+        self.requests["check_in"] += 1
+        if await self._api_delay():
+            return web.Response(status=503)
+        return web.json_response({"success": True})
+
+    async def _check_in_batch(self, request: web.Request) -> web.Response:
+        self.requests["check_in"] += 1
+        payload = json.loads(await request.text())
+        if await self._api_delay():
+            return web.Response(status=503)
+        return web.json_response({"success": True, "results": [{"success": True} for _ in payload["check_ins"]]})
+
+    async def start(self, host: str, port: int) -> None:
+        app = web.Application()
+        app.router.add_get("/calendars/{cal_id}.ics", self._calendar)
+        app.router.add_get("/courses", self._courses)
+        app.router.add_post("/check-in", self._check_in)
+        app.router.add_post("/check-in/batch", self._check_in_batch)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
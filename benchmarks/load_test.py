@@ -0,0 +1,207 @@
+"""
+Drives the calendar cog against a fake Discord, a local calendar server and a mock API:
+updates the calendars, waits for their live events to be posted, then fires the reactions of all the students
+and reports the check-in throughput and latency, the event loop lag and the memory used
+"""
+# Variables
+from benchmarks import config
+
+# Custom modules
+import metrics
+from cogs.calendar import CalendarCog
+from students import StudentRegistry
+from benchmarks.fake_discord import FakeBot, FakeGateway
+from benchmarks.fake_servers import FakeServers, generate_calendar
+
+import argparse
+import arrow
+import asyncio
+import json
+import logging
+import resource
+import tempfile
+import time
+import tracemalloc
+import typing
+from os.path import join
+
+
+def percentile(values: typing.List[float], p: float) -> float:
+    if not values:
+        return 0.
+    values = sorted(values)
+    return values[min(int(p * len(values)), len(values) - 1)]
+
+
+async def probe_loop_lag(samples: typing.List[float], interval: float = 0.01) -> None:
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(time.perf_counter() - start - interval, 0))
+
+
+async def wait_for(predicate: typing.Callable[[], bool], timeout: float) -> bool:
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > deadline:
+            return False
+        await asyncio.sleep(0.01)
+    return True
+
+
+def configure(folder: str, base_url: str, args: argparse.Namespace) -> None:
+    """
+    Points the configuration at the temporary folder and the fake servers
+    """
+    config.CALENDARS_FOLDER = folder
+    config.STUDENTS_FILE = join(folder, "students.json")
+    config.CHECK_IN_QUEUE_FILE = join(folder, "check_in_queue.json")
+    config.SESSIONS_JOURNAL_FILE = join(folder, "sessions.journal")
+    config.API_BASE_URL = base_url
+    config.API_COURSES_ENDPOINT = base_url + "courses"
+    config.API_CHECK_IN_ENDPOINT = base_url + "check-in"
+    config.API_CHECK_IN_BATCH_ENDPOINT = base_url + "check-in/batch" if args.batch else None
+    config.CHECK_IN_RETRY_BACKOFF = 0.1
+    config.HTTP_RETRY_BACKOFF = 0.05
+
+
+async def run(args: argparse.Namespace) -> None:
+    logger = logging.getLogger("load_test")
+    folder = tempfile.TemporaryDirectory()
+    base_url = f"http://{args.host}:{args.port}/"
+    configure(folder.name, base_url, args)
+
+    now = time.time()
+    live_begin, live_end = now - 60, now + 60 * 60
+    cal_ids = [f"calendar-{i}" for i in range(args.calendars)]
+    calendars = [{
+        "id": cal_id,
+        "url": f"{base_url}calendars/{cal_id}.ics",
+        "channel_id": 100 + i,
+        "role_id": 200 + i,
+        "role_mention": True,
+        "embed": {"color": "0xeeb948", "thumbnail": "https://domain.tld/image.png"}
+    } for i, cal_id in enumerate(cal_ids)]
+    slot = [arrow.Arrow.utcfromtimestamp(ts).to(config.TIMEZONE).strftime("%H:%M") for ts in (live_begin, live_end)]
+    course = {"id": 1, "name": "Live", "start": slot[0], "end": slot[1]}
+
+    # Each student is part of a single calendar
+    students = {str(10000 + i): [f"student{i}", "Last", "First", [cal_ids[i % len(cal_ids)]]]
+                for i in range(args.students)}
+    with open(config.STUDENTS_FILE, "w", encoding="utf-8") as fd:
+        json.dump(students, fd)
+
+    servers = FakeServers({cal_id: generate_calendar(cal_id, live_begin, live_end, tracks=args.tracks)
+                           for cal_id in cal_ids},
+                          course, args.api_latency, args.failure_rate)
+    await servers.start(args.host, args.port)
+
+    lags: typing.List[float] = list()
+    lag_probe = asyncio.ensure_future(probe_loop_lag(lags))
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    bot = FakeBot(args.discord_latency)
+    registry = StudentRegistry(config.STUDENTS_FILE, cal_ids, logger=logger)
+    cog = CalendarCog(bot, registry, calendars, check_in=True, logger=logger)
+
+    start = time.perf_counter()
+    statuses = await cog._update_calendars()
+    update_time = time.perf_counter() - start
+    events = sum(len(state.index) for state in cog.states.values())
+
+    # What start_loops does, without the periodic update
+    for state in cog.states.values():
+        cog.start_pipeline(state)
+    cog.scheduler.start()
+    if cog.warmup_scheduler is not None:
+        cog.warmup_scheduler.start()
+    cog.check_in_queue.start()
+    cog.notifications.start()
+    cog.journal.start()
+
+    start = time.perf_counter()
+    live_events = len(cal_ids) * args.tracks
+    if not await wait_for(lambda: len(cog.sessions) == live_events, args.timeout):
+        logger.error(f"Only {len(cog.sessions)} of the {live_events} live events were posted")
+    post_time = time.perf_counter() - start
+    # calendar_id : the messages of its live events
+    messages = dict()
+    for message_id, session in cog.sessions.items():
+        messages.setdefault(session.calendar_id, list()).append(message_id)
+
+    # The students of a calendar are split between its tracks
+    reactions = [(int(_id), messages[entry[3][0]][i // len(cal_ids) % len(messages[entry[3][0]])])
+                 for i, (_id, entry) in enumerate(students.items()) if entry[3][0] in messages]
+    gateway = FakeGateway(bot, cog)
+    start = time.perf_counter()
+    await gateway.run(args.rate, reactions)
+    done = await wait_for(lambda: all(bot.get_user(user_id).dms for user_id, _ in reactions), args.timeout)
+    check_in_time = time.perf_counter() - start
+    latencies = [bot.get_user(user_id).dms[0] - gateway.dispatched[user_id]
+                 for user_id, _ in reactions if bot.get_user(user_id).dms]
+    # Let the last counter updates go out
+    await asyncio.sleep(config.EMBED_UPDATE_WINDOW)
+
+    lag_probe.cancel()
+    for session in list(cog.sessions.values()):
+        session.task.cancel()
+        session.updater.cancel()
+    cog.cog_unload()
+    await asyncio.sleep(0.1)
+    await servers.stop()
+    folder.cleanup()
+
+    print(f"Calendars: {len(cal_ids)} with {args.tracks} live event(s) each, students: {len(students)}, "
+          f"reactions: {args.rate}/s, "
+          f"API latency: {args.api_latency * 1000:.0f} ms, failure rate: {args.failure_rate:.0%}"
+          f"{', batched' if args.batch else ''}")
+    print(f"Calendar update: {update_time:.2f} s for {events} event(s), "
+          f"{sum(status.value != 'error' for status in statuses.values())}/{len(statuses)} calendar(s) updated")
+    print(f"Live events posted in {post_time * 1000:.0f} ms")
+    print(f"Check-ins: {len(latencies)}/{len(reactions)}{'' if done else ' (timed out)'} in {check_in_time:.2f} s, "
+          f"{len(latencies) / check_in_time:.1f}/s")
+    print(f"Check-in latency: p50 {percentile(latencies, .5) * 1000:.0f} ms, "
+          f"p99 {percentile(latencies, .99) * 1000:.0f} ms, max {max(latencies, default=0) * 1000:.0f} ms")
+    print(f"Loop lag: p50 {percentile(lags, .5) * 1000:.1f} ms, p99 {percentile(lags, .99) * 1000:.1f} ms, "
+          f"max {max(lags, default=0) * 1000:.1f} ms")
+    edits = sum(message.edits for channel in bot.channels.values() for message in channel.messages.values())
+    print(f"Message edits: {edits} for {metrics.EMBED_UPDATE_REQUESTS.total():.0f} update(s)")
+    print(f"API requests: {servers.requests}")
+    # In KiB on Linux
+    print(f"Max RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB", end="")
+    if args.tracemalloc:
+        current, peak = tracemalloc.get_traced_memory()
+        print(f", traced: {current / 2 ** 20:.1f} MiB, peak {peak / 2 ** 20:.1f} MiB", end="")
+    print()
+    for metric in metrics.REGISTRY:
+        if isinstance(metric, metrics.Histogram):
+            count, average, p99 = metric.summary()
+            if count:
+                print(f"  {metric.name}: {count}, average {average * 1000:.2f} ms, p99 <= {p99 * 1000:g} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load tests the calendar cog against fake Discord and API servers")
+    parser.add_argument("-c", "--calendars", default=10, type=int, help="the number of calendars")
+    parser.add_argument("-t", "--tracks", default=1, type=int,
+                        help="the number of live events of each calendar, happening at the same time")
+    parser.add_argument("-s", "--students", default=1000, type=int, help="the number of students")
+    parser.add_argument("-r", "--rate", default=100, type=float, help="the number of reactions per second")
+    parser.add_argument("--api-latency", default=0.1, type=float, help="the average latency of the API, in seconds")
+    parser.add_argument("--failure-rate", default=0.05, type=float, help="the probability of an API request to fail")
+    parser.add_argument("--discord-latency", default=0.05, type=float,
+                        help="the latency of the Discord API, in seconds")
+    parser.add_argument("--batch", action="store_true", help="use the batch check-in endpoint")
+    parser.add_argument("--tracemalloc", action="store_true", help="trace the memory allocations, slows the test down")
+    parser.add_argument("--timeout", default=120, type=float, help="the timeout of each phase, in seconds")
+    parser.add_argument("--host", default="127.0.0.1", type=str, help="the host of the fake servers")
+    parser.add_argument("--port", default=8765, type=int, help="the port of the fake servers")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+from event_index import EventIndex
+from live_session import LiveSession
+from prepared_event import PreparedEvent
+
+import asyncio
+import typing
+
+
+class CalendarState:
+    """
+    Everything the bot keeps about a calendar. Each calendar has its own locks and pipeline task,
+    so that a calendar never waits on another one.
+    """
+    def __init__(self, calendar_data: dict):
+        """
+
+        :param calendar_data: The configuration of the calendar
+        """
+        self.id: str = calendar_data["id"]
+        self.data = calendar_data
+
+        # Protects the feed file, the snapshot and the index
+        self.lock = asyncio.Lock()
+
+        self.index = EventIndex()
+        # {"etag", "last_modified", "hash"} of the feed stored on disk
+        self.feed: dict = dict()
+        # The hash of the feed currently parsed in memory
+        self.loaded_hash: typing.Union[str, None] = None
+        # The epoch timestamp of the end of the window of the events in the index
+        self.window_end = 0.
+
+        # The key of the last event posted, its uid for those posted before the keys
+        self.last_event: str = ""
+        # event uid : the session of the event, while students can still check-in, events can overlap
+        self.sessions: typing.Dict[str, LiveSession] = dict()
+        # event key : the upcoming events prepared by the warmup
+        self.prepared: typing.Dict[str, PreparedEvent] = dict()
+        # event uid : the sessions replayed from the journal, until the calendar is loaded and they are resumed
+        self.saved_sessions: typing.Dict[str, dict] = dict()
+        # Whether or not the saved sessions are being resumed
+        self.restoring = False
+
+        # Set by the scheduler when an event of the calendar begins
+        self.triggered = asyncio.Event()
+        self.task: typing.Union[asyncio.Task, None] = None
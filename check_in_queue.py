@@ -0,0 +1,172 @@
+# Variables
+import config
+
+# Custom modules
+import tools
+from persistence import FileWriter
+
+import asyncio
+import json
+import logging
+import time
+import typing
+
+# (username, course id)
+Key = typing.Tuple[str, typing.Union[int, str]]
+# (message id, user id, course) of the reaction a check-in was submitted for
+Origin = typing.Tuple[int, int, dict]
+
+
+class CheckInQueue:
+    """
+    Submits the check-ins to the API with a bounded pool of workers, retrying those which couldn't reach it
+    with an exponential backoff. A check-in is only submitted once per student and course for
+    config.CHECK_IN_SUCCESS_TTL seconds, and the pending ones are saved with their origin so that they are
+    submitted again after a restart and their outcome still reported.
+    """
+    def __init__(self, logger: logging.Logger = logging.getLogger("CheckInQueue"), file: str = None,
+                 writer: FileWriter = None, on_resumed: typing.Callable[[Origin, bool], None] = None):
+        """
+
+        :param logger: An optional logger
+        :param file: The file the pending check-ins are saved to, defaults to config.CHECK_IN_QUEUE_FILE
+        :param writer: The writer of the file, a new one by default
+        :param on_resumed: Called with the origin and the outcome of the check-ins submitted before a restart,
+        must not block
+        """
+        self.logger = logger
+        self.file = config.CHECK_IN_QUEUE_FILE if file is None else file
+        self.writer = FileWriter(logger=logger) if writer is None else writer
+        self.on_resumed = on_resumed
+
+        self.queue: asyncio.Queue = asyncio.Queue()
+        # key : number of failed attempts
+        self.pending: typing.Dict[Key, int] = dict()
+        # key : the origin of the pending check-in, if known
+        self.origins: typing.Dict[Key, Origin] = dict()
+        # key : the future resolved with the final outcome
+        self.futures: typing.Dict[Key, asyncio.Future] = dict()
+        # key : when it can be submitted again, as a time.monotonic() timestamp, in that order
+        self.succeeded: typing.Dict[Key, float] = dict()
+        self.workers: typing.List[asyncio.Task] = list()
+
+    def start(self) -> None:
+        if self.workers:
+            return
+        self._load()
+        for key in self.pending:
+            self.queue.put_nowait(key)
+        self.workers = [asyncio.ensure_future(self._work()) for _ in range(config.CHECK_IN_WORKERS)]
+
+    def stop(self) -> None:
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = list()
+
+    async def submit(self, username: str, course_id: typing.Union[int, str], origin: Origin = None) -> bool:
+        """
+        Submits a check-in, or waits for the same one if it was already submitted
+        :param username: The username of the student
+        :param course_id: The id of the course
+        :param origin: The reaction the check-in was submitted for, to report its outcome after a restart
+        :return: Whether or not the student was checked-in, once all the attempts are done
+        """
+        key = (username, course_id)
+        self._prune()
+        if key in self.succeeded:
+            return True
+        future = self.futures.get(key)
+        if future is None:
+            future = asyncio.get_event_loop().create_future()
+            self.futures[key] = future
+            if key not in self.pending:
+                self.pending[key] = 0
+                if origin is not None:
+                    self.origins[key] = origin
+                self.queue.put_nowait(key)
+                self._save()
+        return await asyncio.shield(future)
+
+    def _prune(self) -> None:
+        # The course ids may be reused, e.g. the next day
+        now = time.monotonic()
+        while self.succeeded:
+            key, expiry = next(iter(self.succeeded.items()))
+            if expiry > now:
+                break
+            del self.succeeded[key]
+
+    async def _work(self) -> None:
+        while True:
+            keys = [await self.queue.get()]
+            if config.API_CHECK_IN_BATCH_ENDPOINT:
+                while len(keys) < config.CHECK_IN_BATCH_SIZE and not self.queue.empty():
+                    keys.append(self.queue.get_nowait())
+
+            results = await self._attempt(keys)
+            for key, result in zip(keys, results):
+                attempts = self.pending[key]
+                if result is None and attempts < config.CHECK_IN_RETRIES:
+                    delay = config.CHECK_IN_RETRY_BACKOFF * 2 ** attempts
+                    self.logger.debug(f"Check-in of {key[0]} for course {key[1]} failed, retrying in {delay}s")
+                    self.pending[key] = attempts + 1
+                    asyncio.get_event_loop().call_later(delay, self.queue.put_nowait, key)
+                else:
+                    self._resolve(key, bool(result))
+            self._save()
+
+    async def _attempt(self, keys: typing.List[Key]) -> typing.List[typing.Union[bool, None]]:
+        """
+        Submits the check-ins once, the retries are handled by the queue
+        :param keys: The check-ins to submit, only one unless the batch endpoint is enabled
+        :return: The outcome of each check-in, None for those which may be retried
+        """
+        try:
+            if config.API_CHECK_IN_BATCH_ENDPOINT:
+                results = await asyncio.wait_for(tools.check_in_batch(keys, self.logger, retries=0),
+                                                 config.CHECK_IN_TIMEOUT)
+                return results if results is not None else [None] * len(keys)
+            username, course_id = keys[0]
+            return [await asyncio.wait_for(tools.check_in(username, course_id, self.logger, retries=0),
+                                           config.CHECK_IN_TIMEOUT)]
+        except asyncio.TimeoutError:
+            return [None] * len(keys)
+        except Exception as e:
+            # e.g. an unexpected response, the worker must go on or the check-ins would never be resolved
+            self.logger.exception(f"Unexpected error while checking-in {len(keys)} student(s): {e}")
+            return [None] * len(keys)
+
+    def _resolve(self, key: Key, status: bool) -> None:
+        del self.pending[key]
+        origin = self.origins.pop(key, None)
+        if status:
+            self.succeeded[key] = time.monotonic() + config.CHECK_IN_SUCCESS_TTL
+        future = self.futures.pop(key, None)
+        if future is None:
+            # Submitted before a restart, nobody is waiting for it anymore
+            self.logger.info(f"Check-in of {key[0]} for course {key[1]} resumed after a restart: {status}")
+            if origin is not None and self.on_resumed is not None:
+                self.on_resumed(origin, status)
+        elif not future.done():
+            future.set_result(status)
+
+    def _load(self) -> None:
+        self.pending, self.origins = dict(), dict()
+        try:
+            with open(self.file, "r", encoding="utf-8") as fd:
+                rows = json.load(fd)
+            for username, course_id, attempts, *origin in rows:
+                self.pending[(username, course_id)] = attempts
+                # Saved without their origin before it was
+                if origin and origin[0] is not None:
+                    message_id, user_id, course = origin[0]
+                    self.origins[(username, course_id)] = (message_id, user_id, course)
+        except (IOError, json.JSONDecodeError, ValueError, TypeError):
+            self.pending, self.origins = dict(), dict()
+
+    def _save(self) -> None:
+        # Merged with the next saves, the pending check-ins are serialized when the file is written
+        self.writer.request(self.file, lambda: json.dumps(
+            [[username, course_id, attempts, self.origins.get((username, course_id))]
+             for (username, course_id), attempts in self.pending.items()]
+        ).encode("utf-8"))
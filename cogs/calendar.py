@@ -3,58 +3,170 @@ import config
 
 # Custom modules
 import tools
+import http_client
+import metrics
+import ics_stream
+from event_index import EventIndex, EventRecord, EventDiff
+from snapshot import read_snapshot, write_snapshot
+from scheduler import EventScheduler
+from calendar_state import CalendarState
+from live_session import LiveSession
+from embed_updater import EmbedUpdater
+from check_in_queue import CheckInQueue
+from courses_cache import CoursesCache
+from journal import SessionJournal
+from students import StudentRegistry
+from shared_state import SharedState
+from notifications import NotificationQueue
+from prepared_event import PreparedEvent
+import persistence
 
 import discord
 from discord.ext import tasks, commands
 import asyncio
-import requests
-from ics import Calendar, Event
 import json
 import typing
 import logging
-from arrow import now
-from os.path import isdir
+import hashlib
+import io
+import functools
+import time
+from enum import Enum
+from os.path import isdir, isfile
 from os import makedirs
 
 from typing import List, Dict
 
 
+class UpdateStatus(Enum):
+    UPDATED = "updated"
+    UNCHANGED = "unchanged"
+    ERROR = "error"
+
+
 class CalendarCog(commands.Cog):
-    def __init__(self, bot: commands.Bot, students: dict, calendars: List[Dict], check_in: bool = False, logger: logging.Logger = logging.getLogger("Calendar")):
+    def __init__(self, bot: commands.Bot, students: StudentRegistry, calendars: List[Dict], check_in: bool = False, logger: logging.Logger = logging.getLogger("Calendar"), shared_state: SharedState = None):
         """
 
         :param bot: The bot
-        :param students: The dictionary mapping the students' discord IDs to their identities
-        :param calendars: The list of the configuration of all calendars
+        :param students: The registry of the students
+        :param calendars: The list of the configuration of the calendars handled by the bot
         :param check_in: Whether or not to enable check-ins
         :param logger: An optional logger
+        :param shared_state: The state shared with the other shards, if the calendars are split between several bots
         """
         self.bot = bot
-        self.reacted: dict[str, set] = {cal["id"]: set() for cal in calendars}
-        self.calendar_lock = asyncio.Lock()
-        self.data_lock = asyncio.Lock()
 
         self.students = students
+        self.shared_state = shared_state
+        shard_id = shared_state.shard_id if shared_state is not None else None
 
-        # self.calendars_data = calendars
-        self.calendars_data = {cal["id"]: cal for cal in calendars}
-        # Dict of empty calendars for now, mapped by their id in the config file
-        self.calendars: dict[str, Calendar] = {cal["id"]: Calendar() for cal in calendars}
+        # The states of the calendars, with empty indexes for now, mapped by their id in the config file
+        self.states: dict[str, CalendarState] = {cal["id"]: CalendarState(cal) for cal in calendars}
 
         self.enable_check_ins = check_in
         self.logger = logger
 
-        self.last_statuses: dict[str, bool] = {cal["id"]: False for cal in calendars}
-
-        # calendar_id : event_id
-        self.last_events: dict[str, str] = {cal["id"]: None for cal in calendars}
+        # message_id : session, for every message students can currently react to
+        self.sessions: dict[int, LiveSession] = dict()
+
+        # Writes the state files of the calendars and of the check-in queue
+        self.writer = persistence.FileWriter(logger=self.logger)
+        self.check_in_queue = CheckInQueue(logger=self.logger,
+                                           file=tools.get_shard_filename(config.CHECK_IN_QUEUE_FILE, shard_id),
+                                           writer=self.writer,
+                                           on_resumed=self.on_check_in_resumed)
+        self.courses = CoursesCache(logger=self.logger)
+        self.notifications = NotificationQueue(logger=self.logger)
+
+        self.last_statuses: dict[str, UpdateStatus] = {cal["id"]: UpdateStatus.ERROR for cal in calendars}
+
+        self.scheduler = EventScheduler(self.states,
+                                        lambda cal_id: self.states[cal_id].index,
+                                        self.check_events,
+                                        logger=self.logger)
+        # Triggers the calendars ahead of their events, to prepare them
+        self.warmup_scheduler: typing.Union[EventScheduler, None] = None
+        if config.WARMUP_LEAD:
+            self.warmup_scheduler = EventScheduler(self.states,
+                                                   lambda cal_id: self.states[cal_id].index,
+                                                   self.check_warmup,
+                                                   logger=self.logger,
+                                                   lead=config.WARMUP_LEAD)
 
         self.verify_calendars_folder()
+        self.journal = SessionJournal(tools.get_shard_filename(config.SESSIONS_JOURNAL_FILE, shard_id),
+                                      logger=self.logger)
+        self.journal.replay()
         self.load_data()
+        self.load_snapshots()
+
+    def cog_unload(self):
+        self.scheduler.stop()
+        if self.warmup_scheduler is not None:
+            self.warmup_scheduler.stop()
+        self.check_in_queue.stop()
+        self.notifications.stop()
+        self.students.stop()
+        for state in self.states.values():
+            if state.task is not None:
+                state.task.cancel()
+        self.bot.loop.create_task(self.writer.flush())
+        self.bot.loop.create_task(self.journal.close())
+        self.bot.loop.create_task(http_client.close_session())
+        if self.shared_state is not None:
+            self.shared_state.close()
 
     def start_loops(self):
-        self.update_calendars.start()
-        self.check_events.start()
+        # on_ready is dispatched again after each reconnection
+        if not self.update_calendars.is_running():
+            # Resume the sessions of the calendars loaded from their snapshots, before they are updated
+            for state in self.states.values():
+                if state.saved_sessions and len(state.index):
+                    self.bot.loop.create_task(self._restore_sessions(state))
+            self.update_calendars.start()
+        for state in self.states.values():
+            if state.task is None:
+                self.start_pipeline(state)
+        self.scheduler.start()
+        if self.warmup_scheduler is not None:
+            self.warmup_scheduler.start()
+        self.check_in_queue.start()
+        self.notifications.start()
+        self.journal.start()
+        self.students.start()
+
+    def start_pipeline(self, state: CalendarState) -> None:
+        """
+        Starts the pipeline task of a calendar, it is restarted by the supervisor if it crashes
+        :param state: The state of the calendar
+        :return: None
+        """
+        state.task = self.bot.loop.create_task(self.run_pipeline(state))
+        state.task.add_done_callback(functools.partial(self._supervise_pipeline, state))
+
+    def _supervise_pipeline(self, state: CalendarState, task: asyncio.Task) -> None:
+        if task.cancelled():
+            return
+        self.logger.error(f"Pipeline of calendar {state.id} crashed, restarting it in {config.PIPELINE_RESTART_DELAY}s",
+                          exc_info=task.exception())
+        # Check the calendar again once restarted, in case the crash happened before its event was handled
+        state.triggered.set()
+        self.bot.loop.call_later(config.PIPELINE_RESTART_DELAY, self.start_pipeline, state)
+
+    async def run_pipeline(self, state: CalendarState) -> None:
+        """
+        The loop handling the events of a single calendar, each time the scheduler triggers it
+        :param state: The state of the calendar
+        :return: None
+        """
+        while True:
+            await state.triggered.wait()
+            state.triggered.clear()
+            # Several events can begin at the same time, each has its own message
+            for event in await self.get_new_events(state.id):
+                self.logger.info(f"New event found for calendar {state.id}")
+                await self.send_event(state.id, event)
 
     @staticmethod
     def verify_calendars_folder() -> None:
@@ -69,18 +181,101 @@ class CalendarCog(commands.Cog):
         """
         self.last_statuses = await self._update_calendars()
 
-    @tasks.loop(seconds=config.EVENT_CHECK_INTERVAL)
-    async def check_events(self) -> None:
+    def check_events(self, cal_id: str) -> None:
+        """
+        Called by the scheduler when an event of the calendar begins, wakes the pipeline of the calendar up
+        :param cal_id: The id of the calendar
+        :return: None
+        """
+        self.states[cal_id].triggered.set()
+
+    def check_warmup(self, cal_id: str) -> None:
         """
-        The loop that checks if a new event is happening
+        Called by the warmup scheduler ahead of the events of the calendar, prepares them
+        :param cal_id: The id of the calendar
         :return: None
         """
-        for cal_id in self.calendars:
-            event = await self.get_last_event(cal_id)
-            if event and event.uid != self.last_events[cal_id]:
-                # There is a new event
-                self.logger.info(f"New event found for calendar {cal_id}")
-                await self.send_event(cal_id, event)
+        task = self.bot.loop.create_task(self.warm_up(cal_id))
+        task.add_done_callback(functools.partial(self._log_warmup_failure, cal_id))
+
+    def _log_warmup_failure(self, cal_id: str, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.error(f"Warmup of calendar {cal_id} failed", exc_info=task.exception())
+
+    async def warm_up(self, calendar_id: str) -> None:
+        """
+        Prepares the events of a calendar beginning within config.WARMUP_LEAD seconds,
+        and reports the problems found to the admins
+        :param calendar_id: The id of the calendar
+        :return: None
+        """
+        state = self.states[calendar_id]
+        now = time.time()
+        # Those which were never posted
+        state.prepared = {key: prepared for key, prepared in state.prepared.items() if prepared.event.end_ts > now}
+        for event in state.index.beginning(now, now + config.WARMUP_LEAD):
+            if event.key in state.prepared:
+                continue
+            try:
+                prepared = await self.prepare_event(calendar_id, event)
+            except Exception as e:
+                # The next events are still prepared, this one is when it is posted
+                self.logger.exception(f"Couldn't prepare event {event.uid} of calendar {calendar_id}: {e}")
+                continue
+            state.prepared[event.key] = prepared
+            if prepared.problems:
+                await self.report_problems(calendar_id, prepared)
+
+    async def prepare_event(self, calendar_id: str, event: EventRecord) -> PreparedEvent:
+        """
+        Resolves everything needed to post an event, and checks that it can be checked-in to
+        :param calendar_id: The id of the calendar the event is part of
+        :param event: The calendar event
+        :return: The prepared event
+        """
+        prepared = self.resolve_event(calendar_id, event)
+        prepared.courses = await self.get_event_courses(event)
+        if self.enable_check_ins:
+            if not prepared.courses:
+                prepared.problems.append("No course matches the event")
+            if not await tools.is_api_reachable(self.logger):
+                prepared.problems.append("The check-in API can't be reached")
+
+        self.logger.debug(f"Prepared event {event.uid} of calendar {calendar_id}, "
+                          f"{len(prepared.problems)} problem(s)")
+        return prepared
+
+    def resolve_event(self, calendar_id: str, event: EventRecord) -> PreparedEvent:
+        """
+        Resolves what is needed to post an event without calling the API, its courses are left empty
+        :param calendar_id: The id of the calendar the event is part of
+        :param event: The calendar event
+        :return: The event, prepared except for its courses
+        """
+        cal_data = self.states[calendar_id].data
+        problems = list()
+
+        channel: typing.Union[discord.TextChannel, None] = self.bot.get_channel(cal_data["channel_id"])
+        role: typing.Union[discord.Role, None] = None
+        if channel is None:
+            problems.append(f"Channel {cal_data['channel_id']} not found")
+        elif cal_data["role_mention"]:
+            role = channel.guild.get_role(cal_data["role_id"])
+            if role is None:
+                problems.append(f"Role {cal_data['role_id']} not found")
+        return PreparedEvent(event, channel, role, tools.EventEmbed(event, cal_data), list(), problems)
+
+    async def report_problems(self, calendar_id: str, prepared: PreparedEvent) -> None:
+        self.logger.warning(f"Problems with the next event of calendar {calendar_id}: {', '.join(prepared.problems)}")
+        message = f":warning: **{prepared.embed.title}** ({calendar_id}, {prepared.embed.hours.lower()}):\n"
+        message += "\n".join(f"- {problem}" for problem in prepared.problems)
+        for admin_id in config.BOT_ADMINS:
+            try:
+                admin = self.bot.get_user(admin_id) or await self.bot.fetch_user(admin_id)
+            except discord.HTTPException as e:
+                self.logger.error(f"Couldn't find admin {admin_id}: {e}")
+                continue
+            self.notifications.notify(admin, message)
 
     @commands.command()
     async def update(self, ctx: commands.Context) -> None:
@@ -89,137 +284,322 @@ class CalendarCog(commands.Cog):
         :param ctx: The context
         :return: None
         """
+        self.courses.invalidate()
         self.last_statuses = await self._update_calendars()
+        icons = {
+            UpdateStatus.UPDATED: ":white_check_mark: ",
+            UpdateStatus.UNCHANGED: ":zzz: ",
+            UpdateStatus.ERROR: ":x: "
+        }
         message = ":bell: **Update status:**\n"
         for _id, status in self.last_statuses.items():
-            message += ":white_check_mark: " if status else ":x: "
-            message += _id
+            message += icons[status]
+            message += f"{_id} ({status.value})"
             message += "\n"
         await ctx.send(message)
 
-    async def send_event(self, calendar_id: str, event: Event):
+    @metrics.SEND_EVENT_SECONDS.time()
+    async def send_event(self, calendar_id: str, event: EventRecord):
         """
-        Sends the event from the specified calendar to the corresponding channel and mention if enabled
+        Sends the event from the specified calendar to the corresponding channel and mention if enabled,
+        then opens its session so that students can check-in by reacting
         :param calendar_id: The id of the calendar the event is part of
         :param event: The calendar event
         :return:
         """
+        state = self.states[calendar_id]
         # Update the last event
-        self.last_events[calendar_id] = event.uid
-        async with self.data_lock:
-            data_file = tools.get_calendar_data_filename(calendar_id)
-            with open(data_file, "w") as fd:
-                json.dump(self.gen_data(calendar_id), fd)
-
-        cal_data = self.calendars_data[calendar_id]
+        state.last_event = event.key
+        self.journal.set_last_event(calendar_id, event.key)
+        if self.shared_state is not None and not await self.shared_state.claim_event(calendar_id, event.key):
+            self.logger.warning(f"Event {event.uid} of calendar {calendar_id} was already posted by another shard")
+            return
 
-        # Getting the channel to send the event to
-        cal_channel = cal_data["channel_id"]
-        channel: discord.TextChannel = self.bot.get_channel(cal_channel)
+        # Prepared by the warmup, unless it is disabled or the bot started in the meantime,
+        # otherwise the courses are only fetched once the message is sent
+        prepared = state.prepared.pop(event.key, None)
+        if prepared is None or prepared.channel is None:
+            prepared = self.resolve_event(calendar_id, event)
+        if prepared.channel is None:
+            # Marked as posted anyway, it would fail the same way each time the calendar is triggered
+            self.logger.error(f"Couldn't post event {event.uid} of calendar {calendar_id}, its channel wasn't found")
+            prepared.problems.append("The event couldn't be posted")
+            await self.report_problems(calendar_id, prepared)
+            return
+        channel = prepared.channel
         self.logger.debug(f"Got channel '{channel.name}' for calendar {calendar_id}")
 
-        # Getting the role to mention if enabled in the config
-        role: typing.Union[discord.Role, None] = None
-        if cal_data["role_mention"]:
-            role = channel.guild.get_role(cal_data["role_id"])
-
-        # Generating the base embed
-        embed = tools.generate_event_embed(event, (0, len(self.students)),  cal_data)
-        content = role.mention if role else ""
-        bot_message: discord.Message = await channel.send(content=content, embed=embed)
+        event_embed = prepared.embed
+        content = prepared.content
+        bot_message: discord.Message = await channel.send(content=content,
+                                                           embed=event_embed.render((0, self.students.roster_size(calendar_id))))
 
         if self.enable_check_ins:
             await bot_message.add_reaction(config.REACTION_EMOJI)
 
-        self.reacted[calendar_id] = set()  # The users who reacted
-        courses = tools.get_courses()
-        self.logger.debug(f"Got {len(courses)} course(s): {', '.join([course['name'] for course in courses])}")
+        # Not prepared, or the API may have come back since the warmup
+        courses = prepared.courses or await self.get_event_courses(event)
+        ends_at = event.end_ts + config.CHECK_IN_GRACE_PERIOD
+        session = LiveSession(calendar_id, event, channel.id, bot_message.id, courses, event_embed, ends_at,
+                              content, bot_message)
+        await self.open_session(session)
+
+    async def apply_changes(self, calendar_id: str, changes: EventDiff) -> None:
+        """
+        Updates the live sessions of a calendar whose events changed
+        :param calendar_id: The id of the calendar
+        :param changes: The changes of the events of the calendar
+        :return: None
+        """
+        removed = {event.uid for event in changes.removed}
+        changed = {event.uid: event for _, event in changes.changed}
+        # Prepared again by the warmup
+        state = self.states[calendar_id]
+        state.prepared = {key: prepared for key, prepared in state.prepared.items()
+                          if prepared.event.uid not in removed and prepared.event.uid not in changed}
+        for session in [s for s in self.sessions.values() if s.calendar_id == calendar_id]:
+            uid = session.event.uid
+            if uid in removed:
+                self.logger.info(f"Event {uid} of calendar {calendar_id} was removed, closing its session")
+                await self.close_session(session)
+            elif uid in changed:
+                event = changed[uid]
+                if event.begin_ts > time.time():
+                    # It is posted again once it begins
+                    self.logger.info(f"Event {uid} of calendar {calendar_id} was postponed, closing its session")
+                    await self.close_session(session)
+                    continue
+                self.logger.info(f"Event {uid} of calendar {calendar_id} changed, updating its message")
+                if (event.begin_ts, event.end_ts) != (session.event.begin_ts, session.event.end_ts):
+                    session.courses = await self.get_event_courses(event)
+                session.event = event
+                session.embed = tools.EventEmbed(event, self.states[calendar_id].data)
+                if session.persistent:
+                    ends_at = event.end_ts + config.CHECK_IN_GRACE_PERIOD
+                    if ends_at != session.ends_at:
+                        session.ends_at = ends_at
+                        session.task.cancel()
+                        session.task = self.bot.loop.create_task(self._expire_session(session))
+                        # So that it still ends at the right time once resumed
+                        self.journal.update_session(session)
+                        if self.shared_state is not None:
+                            await self.shared_state.update_session(session)
+                session.updater.request()
+
+    async def get_event_courses(self, event: EventRecord) -> typing.List[dict]:
         # Only check-in for the current courses (hopefully there's only one)
-        courses = tools.filter_current_courses(event, courses)
+        courses = await self.courses.get_event_courses(event)
         self.logger.debug(f"Filtered courses, remaining course(s): {', '.join([course['name'] for course in courses])}")
+        return courses
 
-        def check(_reaction: discord.Reaction, _user: discord.User):
-            return _reaction.message == bot_message and \
-                   str(_user.id) in self.students and \
-                   str(_reaction.emoji) == config.REACTION_EMOJI and \
-                   _user not in self.reacted[calendar_id]
-
+    async def open_session(self, session: LiveSession) -> None:
+        """
+        Starts routing the reactions to the message of the session, until it ends
+        :param session: The session
+        :return: None
+        """
+        self.sessions[session.message_id] = session
+        session.updater = EmbedUpdater(functools.partial(self._update_session_message, session), logger=self.logger)
+        if session.persistent:
+            state = self.states[session.calendar_id]
+            previous = state.sessions.get(session.event.uid)
+            if previous is not None and previous is not session:
+                await self.close_session(previous)
+            state.sessions[session.event.uid] = session
+            # Restored sessions are already in the journal
+            if session.message_id not in self.journal.sessions:
+                self.journal.open_session(session)
+            if self.shared_state is not None:
+                await self.shared_state.open_session(session)
+        session.task = self.bot.loop.create_task(self._expire_session(session))
+
+    async def _expire_session(self, session: LiveSession) -> None:
+        await asyncio.sleep(max(session.ends_at - time.time(), 0))
+        await self.close_session(session)
+
+    async def close_session(self, session: LiveSession) -> None:
+        """
+        Stops routing the reactions to the message of the session and marks the event as finished
+        :param session: The session
+        :return: None
+        """
+        if self.sessions.pop(session.message_id, None) is None:
+            return  # Already closed
+        if session.task is not None and session.task is not asyncio.current_task():
+            session.task.cancel()
+        session.updater.cancel()
+        if session.persistent:
+            state = self.states[session.calendar_id]
+            if state.sessions.get(session.event.uid) is session:
+                del state.sessions[session.event.uid]
+            self.journal.close_session(session.message_id)
+            if self.shared_state is not None:
+                await self.shared_state.close_session(session.message_id)
+
+        embed = session.embed.render((len(session.reacted), self.students.roster_size(session.calendar_id)), finished=True)
         try:
-            while len(self.reacted[calendar_id]) != len(self.students):
-                timeout = event.end.shift(minutes=+15) - now(config.TIMEZONE)
-                timeout = timeout.seconds
-                timeout = timeout if timeout > 1 else 1
-                reaction, user = await self.bot.wait_for('reaction_add', timeout=timeout, check=check)
-                if self.enable_check_ins:
-                    self.bot.loop.create_task(self.check_in(user, courses, event, calendar_id, bot_message, content))
-
-        except asyncio.TimeoutError:
-            embed = tools.generate_event_embed(event, (len(self.reacted[calendar_id]), len(self.students), cal_data), finished=True)
-            await bot_message.edit(content=content, embed=embed)
-            await bot_message.add_reaction(config.CANCELLED_EMOJI)
-        else:
-            pass
-
-    async def check_in(self,
-                       user: discord.User,
-                       courses: typing.List[dict],
-                       event: Event,
-                       calendar_id: str,
-                       bot_message: discord.Message,
-                       bot_message_content: str = ""):
+            message = await self.get_session_message(session)
+            await message.edit(content=session.content, embed=embed)
+            await message.add_reaction(config.CANCELLED_EMOJI)
+        except discord.HTTPException as e:
+            self.logger.error(f"Couldn't close the event message of calendar {session.calendar_id}: {e}")
+
+    async def _update_session_message(self, session: LiveSession) -> None:
+        embed = session.embed.render((len(session.reacted), self.students.roster_size(session.calendar_id)))
+        message = await self.get_session_message(session)
+        await message.edit(content=session.content, embed=embed)
+
+    async def get_session_message(self, session: LiveSession) -> discord.Message:
+        if session.message is None:
+            channel = self.bot.get_channel(session.channel_id)
+            session.message = await channel.fetch_message(session.message_id)
+        return session.message
+
+    async def _restore_sessions(self, state: CalendarState) -> None:
+        """
+        Resumes the saved sessions of a calendar, once its events are available
+        :param state: The state of the calendar
+        :return: None
         """
+        if state.restoring:
+            return
+        state.restoring = True
+        try:
+            while state.saved_sessions:
+                uid, saved = next(iter(state.saved_sessions.items()))
+                try:
+                    await self._restore_session(state, saved)
+                finally:
+                    # Only dropped once resumed, so that its event isn't seen as new and posted again meanwhile
+                    state.saved_sessions.pop(uid, None)
+        finally:
+            state.restoring = False
+
+    async def _restore_session(self, state: CalendarState, saved: dict) -> None:
+        event = state.index.find(saved["event"])
+        if event is None:
+            self.logger.info(f"The saved event of calendar {state.id} no longer exists, not resuming its session")
+            self.journal.close_session(saved["message_id"])
+            if self.shared_state is not None:
+                await self.shared_state.close_session(saved["message_id"])
+            return
+        courses = await self.get_event_courses(event)
+        session = LiveSession(state.id, event, saved["channel_id"], saved["message_id"], courses,
+                              tools.EventEmbed(event, state.data), saved["ends_at"], saved["content"])
+        session.reacted = set(saved["reacted"])
+        self.logger.info(f"Resuming the session of calendar {state.id}")
+        await self.open_session(session)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent) -> None:
+        """
+        Routes a reaction to the session of its message, if any
+        :param payload: The reaction event, also dispatched for uncached messages
+        :return: None
+        """
+        session = self.sessions.get(payload.message_id)
+        if session is None or \
+                payload.user_id == self.bot.user.id or \
+                str(payload.emoji) != config.REACTION_EMOJI or \
+                not self.students.is_member(payload.user_id, session.calendar_id) or \
+                payload.user_id in session.reacted or \
+                payload.user_id in session.checking_in:
+            return
+        # Sessions opened with !debug always check-in
+        if not self.enable_check_ins and session.persistent:
+            return
+        user = payload.member or self.bot.get_user(payload.user_id) or await self.bot.fetch_user(payload.user_id)
+        await self.check_in(user, session)
 
-        :param user:
-        :param courses:
-        :param event:
-        :param calendar_id: The id of the calendar
-        :param bot_message:
-        :param bot_message_content:
+    @metrics.CHECK_IN_SECONDS.time()
+    async def check_in(self, user: discord.User, session: LiveSession):
+        """
+        Checks-in the user to the courses of the session, then updates the counter of its message
+        :param user: The user who reacted
+        :param session: The session of the message the user reacted to
         :return:
         """
-        student = tools.get_student(user.id, self.students)
+        student = self.students.get(user.id)
+        if student is None:  # Removed by a reload since the reaction
+            return
         username, last_name, first_name = student
         self.logger.debug(f"{first_name} {last_name} reacted")
-        for course in courses:
-            status = tools.check_in(username, course["id"], self.logger)
-            if status:
-                self.reacted[calendar_id].add(user)
-            await self.send_check_in_status(status, course, user)
-            await asyncio.sleep(1)
-        _embed = tools.generate_event_embed(event, (len(self.reacted[calendar_id]), len(self.students)))
-        await bot_message.edit(content=bot_message_content, embed=_embed)
-
-    async def send_check_in_status(self, status: bool, course: dict, user: discord.User) -> bool:
+        session.checking_in.add(user.id)
+        try:
+            statuses = await asyncio.gather(*(self.check_in_queue.submit(username, course["id"],
+                                                                         (session.message_id, user.id, course))
+                                              for course in session.courses))
+        finally:
+            session.checking_in.discard(user.id)
+        if any(statuses):
+            session.reacted.add(user.id)
+            if self.shared_state is not None and session.persistent:
+                await self.shared_state.check_in(session.message_id, user.id)
+        if session.persistent:
+            for status, course in zip(statuses, session.courses):
+                self.journal.check_in(session.message_id, user.id, course["id"], status)
+        # The statuses are only sent once all the attempts are done
+        messages = [self.format_check_in_status(status, course, user)
+                    for status, course in zip(statuses, session.courses)]
+        if config.NOTIFICATION_DIGEST and messages:
+            messages = ["\n".join(messages)]
+        for message in messages:
+            self.notifications.notify(user, message)
+        session.updater.request()
+
+    def on_check_in_resumed(self, origin: typing.Tuple[int, int, dict], status: bool) -> None:
+        """
+        Called by the check-in queue once a check-in submitted before a restart is done
+        :param origin: The message id, user id and course the check-in was submitted for
+        :param status: Whether or not the user was checked-in
+        :return: None
+        """
+        self.bot.loop.create_task(self._resume_check_in(*origin, status))
+
+    async def _resume_check_in(self, message_id: int, user_id: int, course: dict, status: bool) -> None:
+        session = self.sessions.get(message_id)
+        # The session may not be resumed yet
+        saved = next((saved for state in self.states.values() for saved in state.saved_sessions.values()
+                      if saved["message_id"] == message_id), None)
+        if status:
+            if session is not None:
+                session.reacted.add(user_id)
+                session.updater.request()
+            elif saved is not None:
+                saved["reacted"].add(user_id)
+            if self.shared_state is not None and (saved is not None or session is not None and session.persistent):
+                await self.shared_state.check_in(message_id, user_id)
+        # Or it may have ended meanwhile, the user is notified anyway
+        if message_id in self.journal.sessions:
+            self.journal.check_in(message_id, user_id, course["id"], status)
+        try:
+            user = self.bot.get_user(user_id) or await self.bot.fetch_user(user_id)
+        except discord.HTTPException as e:
+            self.logger.error(f"Couldn't find user {user_id} to notify of their check-in: {e}")
+            return
+        self.notifications.notify(user, self.format_check_in_status(status, course, user))
+
+    def format_check_in_status(self, status: bool, course: dict, user: discord.User) -> str:
         if status:
             self.logger.debug(f"Successfully checked-in {user.display_name} for course {course['name']}")
-            try:
-                await user.send(f":white_check_mark: Pointage pour le cours de {course['name']} "
-                                f"de {course['start']} à {course['end']} réussi !")
-            except discord.errors.Forbidden:  # User's DMs are closed
-                self.logger.debug(f"Couldn't send status DM to {user.display_name}")
-        else:
-            self.logger.error(f"Error checking-in {user.display_name} for course {course['name']}")
-            try:
-                await user.send(f":x: Erreur lors du pointage pour le cours de {course['name']} de {course['start']} à {course['end']}.")
-            except discord.errors.Forbidden:  # User's DMs are closed
-                self.logger.debug(f"Couldn't send status DM to {user.display_name}")
-        return status
+            return f":white_check_mark: Pointage pour le cours de {course['name']} " \
+                   f"de {course['start']} à {course['end']} réussi !"
+        self.logger.error(f"Error checking-in {user.display_name} for course {course['name']}")
+        return f":x: Erreur lors du pointage pour le cours de {course['name']} de {course['start']} à {course['end']}."
 
-    async def get_last_event(self, calendar_id: str) -> typing.Union[Event, None]:
+    @metrics.GET_NEW_EVENTS_SECONDS.time()
+    async def get_new_events(self, calendar_id: str) -> typing.List[EventRecord]:
         """
-        Gets the last event of the specified calendar
-        :param calendar_id: The id of the calendar for which to get the last event
-        :return: The current new event for the specified calendar, None if already set or if there is none
+        Gets the events of the specified calendar which are happening but weren't posted yet
+        :param calendar_id: The id of the calendar for which to get the new events
+        :return: The new events, sorted by their beginning
         """
-        async with self.calendar_lock:
-            # Get all the events currently happening
-            events = list(self.calendars[calendar_id].timeline.now())
-        if not events:
-            return
-        # If the last event is already is already correctly set (doesn't handle overlapping of two or more events)
-        if self.last_events[calendar_id] in [e.uid for e in events]:
-            return None
-        return events[0]
+        state = self.states[calendar_id]
+        # Get all the events currently happening, the index is replaced as a whole so it can be read without the lock
+        events = state.index.now()
+        # The events posted are live until they end, even if they changed since, their message was updated instead
+        return [e for e in events if e.uid not in state.sessions and e.uid not in state.saved_sessions and
+                state.last_event not in (e.key, e.uid)]
 
     def gen_data(self, calendar_id: str) -> dict:
         """
@@ -227,66 +607,202 @@ class CalendarCog(commands.Cog):
         :param calendar_id: The id of the calendar for which to generate the data
         :return:
         """
+        state = self.states[calendar_id]
         return {
-            "last_event": self.last_events[calendar_id]
+            "feed": state.feed
         }
 
+    def save_data(self, calendar_id: str) -> None:
+        """
+        Requests the state of a particular calendar to be written to its data file, the writes are merged
+        :param calendar_id: The id of the calendar for which to save the data
+        :return: None
+        """
+        self.writer.request(tools.get_calendar_data_filename(calendar_id),
+                            lambda: json.dumps(self.gen_data(calendar_id)).encode("utf-8"))
+
     def load_data(self) -> None:
         """
-        Loads the last events for all calendars from their data files, if they don't exist, set en empty string as the event
+        Loads the feeds of all calendars from their data files, and their last events and sessions from the journal,
+        or from the shared state if there is one, if they don't exist, set en empty string as the event
         :return:
         """
-        for cal_id in self.calendars_data:
+        if self.shared_state is not None:
+            # The other shards may have posted events of these calendars, before they were handed over to this one
+            last_events, saved_sessions = self.shared_state.load(self.states)
+        else:
+            last_events, saved_sessions = self.journal.last_events, list(self.journal.sessions.values())
+
+        for cal_id, state in self.states.items():
             cal_data_file = tools.get_calendar_data_filename(cal_id)
             try:
                 with open(cal_data_file) as fd:
                     j: dict = json.load(fd)
-                    self.last_events[cal_id] = j.get("last_event", "")
-            except (IOError, json.JSONDecodeError):
-                self.last_events[cal_id] = ""
-
-    async def _load_calendars(self) -> None:
+                    # The last event used to be stored in the data file
+                    state.last_event = j.get("last_event", "")
+                    state.feed = j.get("feed", dict())
+            except json.JSONDecodeError as e:
+                self.logger.warning(f"Invalid data file for calendar {cal_id}, it will be downloaded again: {e}")
+                state.last_event = ""
+                state.feed = dict()
+            except IOError:
+                state.last_event = ""
+                state.feed = dict()
+            state.last_event = last_events.get(cal_id, state.last_event)
+
+        # Only the latest session of each event can be resumed
+        for saved in sorted(saved_sessions, key=lambda saved: saved["ends_at"]):
+            state = self.states.get(saved["calendar"])
+            if state is None:
+                self._discard_saved_session(saved)
+                continue
+            if saved["event"] in state.saved_sessions:
+                self._discard_saved_session(state.saved_sessions[saved["event"]])
+            state.saved_sessions[saved["event"]] = saved
+        # Those left in the journal, when they come from the shared state
+        for saved in list(self.journal.sessions.values()):
+            state = self.states.get(saved["calendar"])
+            kept = state.saved_sessions.get(saved["event"]) if state is not None else None
+            if kept is None or kept["message_id"] != saved["message_id"]:
+                self.journal.close_session(saved["message_id"])
+
+    def _discard_saved_session(self, saved: dict) -> None:
+        self.journal.close_session(saved["message_id"])
+        if self.shared_state is not None:
+            self.bot.loop.create_task(self.shared_state.close_session(saved["message_id"]))
+
+    def load_snapshots(self) -> None:
         """
-        Loads all the calendars from their files, if they are not available, load an empty calendar
+        Loads the events of all calendars from their snapshots, so that they are available before the first update,
+        if they are not available, keep an empty calendar
         :return:
         """
-        for cal_id in self.calendars_data:
-            cal_file = tools.get_calendar_filename(cal_id)
+        for cal_id, state in self.states.items():
             try:
-                with self.calendar_lock:
-                    with open(cal_file, "r", encoding="utf-8") as fd:
-                        self.calendars[cal_id] = Calendar(fd.read())
-            except IOError:
-                self.calendars[cal_id] = Calendar()
+                state.index, state.loaded_hash, state.window_end = \
+                    read_snapshot(tools.get_calendar_snapshot_filename(cal_id))
+                self.logger.debug(f"Loaded {len(state.index)} event(s) from the snapshot of calendar {cal_id}")
+            except (IOError, ValueError):
+                state.index, state.loaded_hash, state.window_end = EventIndex(), None, 0.
 
-    async def _update_calendars(self) -> dict[str, bool]:
+    async def _update_calendars(self) -> dict[str, UpdateStatus]:
         """
-        Update all the calendars and return whether or not they were successfully updated
-        :return:
+        Update all the calendars concurrently, at most config.CALENDAR_UPDATE_CONCURRENCY at a time
+        :return: The update status of each calendar
         """
-        statuses = dict()
-
-        for cal_id in self.calendars_data:
-            if self.logger:
-                self.logger.debug(f"Updating calendar {cal_id}...")
-            cal_url = self.calendars_data[cal_id]["url"]
-            cal_filename = tools.get_calendar_filename(cal_id)
-            try:
-                r = requests.get(cal_url, headers=config.CALENDAR_HEADERS)
-                self.logger.debug(f"Got response code {r.status_code}")
+        semaphore = asyncio.Semaphore(config.CALENDAR_UPDATE_CONCURRENCY)
+
+        async def update(cal_id: str) -> UpdateStatus:
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    status = await self._update_calendar(cal_id)
+                except Exception as e:
+                    # Only this calendar failed, the others and the next updates go on
+                    self.logger.exception(f"ERROR: Unexpected error while updating the calendar {cal_id}: {e}")
+                    status = UpdateStatus.ERROR
+                metrics.CALENDAR_UPDATE_SECONDS.observe(time.perf_counter() - start, status=status.value)
+                return status
+
+        cal_ids = list(self.states)
+        statuses = await asyncio.gather(*(update(cal_id) for cal_id in cal_ids))
+        return dict(zip(cal_ids, statuses))
+
+    async def _update_calendar(self, cal_id: str) -> UpdateStatus:
+        """
+        Update a calendar with a conditional request, the feed is only parsed and written when its content changed
+        :param cal_id: The id of the calendar to update
+        :return: The update status of the calendar
+        """
+        self.logger.debug(f"Updating calendar {cal_id}...")
+        state = self.states[cal_id]
+        cal_url = state.data["url"]
+        cal_filename = tools.get_calendar_filename(cal_id)
+        feed = state.feed
+
+        headers = dict(config.CALENDAR_HEADERS)
+        # Only ask for a conditional response if we still have the feed to fall back on
+        if isfile(cal_filename):
+            if feed.get("etag"):
+                headers["If-None-Match"] = feed["etag"]
+            if feed.get("last_modified"):
+                headers["If-Modified-Since"] = feed["last_modified"]
+
+        # The events kept are those in a sliding window, it must be moved forward even if the feed doesn't change
+        window_start = time.time() - config.CALENDAR_WINDOW_PAST
+        window_end = time.time() + config.CALENDAR_WINDOW_FUTURE
+        window_expiring = state.window_end - time.time() < config.CALENDAR_WINDOW_FUTURE / 2
+
+        # Only stored once the feed is written, otherwise the next update would get a 304 for a feed never loaded
+        etag, last_modified = feed.get("etag"), feed.get("last_modified")
+        try:
+            r = await http_client.get(cal_url, headers=headers, logger=self.logger)
+            self.logger.debug(f"Got response code {r.status}")
+            if r.status == 304:
+                if state.loaded_hash is not None and not window_expiring:
+                    self.logger.info(f"Calendar {cal_id} unchanged")
+                    return UpdateStatus.UNCHANGED
+                # Not parsed yet since the start of the bot or its window has to move, use the feed stored on disk
+                text = await self.bot.loop.run_in_executor(None, persistence.read_feed, cal_filename)
+            else:
                 r.raise_for_status()
-                async with self.calendar_lock:
-                    with open(cal_filename, "w", encoding="utf-8") as f:
-                        f.write(r.text)
-                    self.calendars[cal_id] = Calendar(r.text)
-                if self.logger:
-                    self.logger.info(f"Calendar {cal_id} updated")
-                statuses[cal_id] = True
-
-            except requests.HTTPError as e:
-                print(e)
-                if self.logger:
-                    self.logger.error(f"ERROR: Could not update the calendar {cal_id}")
-                statuses[cal_id] = False
-
-        return statuses
+                text = r.text
+                etag = r.headers.get("ETag")
+                last_modified = r.headers.get("Last-Modified")
+        except (http_client.HTTPError, IOError) as e:
+            self.logger.error(f"ERROR: Could not update the calendar {cal_id}: {e}")
+            return UpdateStatus.ERROR
+
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        changed = state.loaded_hash != digest
+        if not changed and not window_expiring:
+            # Same content as the one loaded, but not stored under the current extension, e.g. after
+            # config.CALENDAR_FEED_COMPRESSION changed
+            if not isfile(cal_filename):
+                async with state.lock:
+                    try:
+                        await self.bot.loop.run_in_executor(None, persistence.write_feed, cal_filename, text)
+                    except OSError as e:
+                        self.logger.error(f"ERROR: Could not write the calendar {cal_id}: {e}")
+                        return UpdateStatus.ERROR
+                feed["hash"] = digest
+            feed["etag"] = etag
+            feed["last_modified"] = last_modified
+            self.save_data(cal_id)
+            self.logger.info(f"Calendar {cal_id} unchanged")
+            return UpdateStatus.UNCHANGED
+
+        # Parsed in a thread so that the event loop isn't blocked by large feeds
+        start = time.perf_counter()
+        events = await self.bot.loop.run_in_executor(None, ics_stream.parse_events,
+                                                     io.StringIO(text), window_start, window_end)
+        metrics.CALENDAR_PARSE_SECONDS.observe(time.perf_counter() - start)
+        index = EventIndex(events)
+        changes = index.diff(state.index)
+        self.logger.debug(f"Parsed {len(index)} event(s) in the window of calendar {cal_id}: {changes}")
+        async with state.lock:
+            # Written in a thread as well, through temporary files so that a crash never leaves them half-written
+            try:
+                if feed.get("hash") != digest or not isfile(cal_filename):
+                    await self.bot.loop.run_in_executor(None, persistence.write_feed, cal_filename, text)
+                await self.bot.loop.run_in_executor(None, write_snapshot, tools.get_calendar_snapshot_filename(cal_id),
+                                                    index, digest, window_end)
+            except OSError as e:
+                self.logger.error(f"ERROR: Could not write the calendar {cal_id}: {e}")
+                return UpdateStatus.ERROR
+            state.index = index
+            state.loaded_hash = digest
+            state.window_end = window_end
+        if changes:
+            self.scheduler.reschedule(cal_id)
+            if self.warmup_scheduler is not None:
+                self.warmup_scheduler.reschedule(cal_id)
+            await self.apply_changes(cal_id, changes)
+        feed["hash"] = digest
+        feed["etag"] = etag
+        feed["last_modified"] = last_modified
+        self.save_data(cal_id)
+        if state.saved_sessions:
+            await self._restore_sessions(state)
+        self.logger.info(f"Calendar {cal_id} {'updated' if changed else 'unchanged, its window moved'}")
+        return UpdateStatus.UPDATED if changed else UpdateStatus.UNCHANGED
@@ -9,6 +9,9 @@ BOT_ADMINS = (
 REACTION_EMOJI = "📌"
 CANCELLED_EMOJI = "❌"
 REACTION_TIMEOUT = 30 * 60  # 30 minutes
+CHECK_IN_GRACE_PERIOD = 15 * 60  # 15 minutes after the end of the event
+WARMUP_LEAD = 5 * 60  # seconds before an event its post is prepared and checked, None to disable the warmup
+EMBED_UPDATE_WINDOW = 2  # minimum seconds between two edits of an event message
 
 # Calendar
 CALENDAR_HEADERS = {
@@ -19,18 +22,60 @@ CALENDAR_HEADERS = {
 }
 
 TIMEZONE = "Europe/Paris"
-EVENT_CHECK_INTERVAL = 2 * 60  # 2 minutes
 CALENDAR_UPDATE_INTERVAL = 12 * 60 * 60  # 12 hours
+CALENDAR_UPDATE_CONCURRENCY = 4  # calendars downloaded at the same time
+# Only the events in this window around the update are kept
+CALENDAR_WINDOW_PAST = 24 * 60 * 60  # 1 day
+CALENDAR_WINDOW_FUTURE = 30 * 24 * 60 * 60  # 30 days
+PIPELINE_RESTART_DELAY = 5  # seconds before restarting a crashed calendar pipeline
+CALENDAR_FEED_COMPRESSION = None  # of the feeds stored on disk: None, "gzip" or "zstd" (needs zstandard)
 
 # API
 API_BASE_URL = "https://api.tld/api/"
 API_COURSES_ENDPOINT = API_BASE_URL + "courses"
 API_CHECK_IN_ENDPOINT = API_BASE_URL + "check-in"
+# Optional, e.g. API_BASE_URL + "check-in/batch", takes {"check_ins": [{"courseID", "username"}, ...]}
+# and answers {"success": true, "results": [{"success": bool}, ...]} in the same order
+API_CHECK_IN_BATCH_ENDPOINT = None
+CHECK_IN_BATCH_SIZE = 20
+CHECK_IN_WORKERS = 4
+CHECK_IN_TIMEOUT = 10  # seconds, for each attempt
+API_PROBE_TIMEOUT = 5  # seconds, to check that the API answers before an event
+CHECK_IN_RETRIES = 4
+CHECK_IN_RETRY_BACKOFF = 2  # seconds, doubled after each retry
+CHECK_IN_SUCCESS_TTL = 6 * 60 * 60  # seconds a successful check-in isn't submitted again, the course ids may be reused
+NOTIFICATION_WORKERS = 4
+NOTIFICATION_RATE = 20  # direct messages per second at most, below the global rate limit of Discord
+NOTIFICATION_CLOSED_TTL = 6 * 60 * 60  # seconds before trying again to message a user whose DMs were closed
+NOTIFICATION_DIGEST = False  # one direct message per event instead of one per course
+COURSES_CACHE_TTL = 15 * 60  # seconds, the courses are fetched again each day anyway
+
+# HTTP
+HTTP_TIMEOUT = 30  # seconds, for the whole request
+HTTP_CONNECTION_LIMIT = 100  # pooled connections in total
+HTTP_CONNECTION_LIMIT_PER_HOST = 10
+HTTP_KEEPALIVE_TIMEOUT = 60  # seconds
+HTTP_RETRIES = 3  # retries after the first attempt
+HTTP_RETRY_BACKOFF = 0.5  # seconds, doubled after each retry
+
+# Metrics
+METRICS_PREFIX = "ensipointing_"
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9100  # of the /metrics endpoint, None to disable it
+METRICS_LOOP_LAG_INTERVAL = 1  # seconds between two event loop lag probes
 
 # Files
 CALENDARS_FOLDER = "./calendars/"
 STUDENTS_FILE = "./students.json"
+STUDENTS_RELOAD_INTERVAL = 30  # seconds between two checks of the students file
 CALENDARS_CONFIG_FILE = "./calendars.json"
+CHECK_IN_QUEUE_FILE = "./check_in_queue.json"
+SESSIONS_JOURNAL_FILE = "./sessions.journal"
+SESSIONS_JOURNAL_SYNC_INTERVAL = 1  # seconds between two syncs of the journal to the disk
+STATE_WRITE_DELAY = 1  # seconds the writes of a state file wait to be merged with the next ones
+# Shared by the shards, with --shard-count, the queue and journal files get the id of their shard as a suffix
+SHARED_STATE_FILE = "./shared_state.sqlite3"
+SHARED_STATE_TIMEOUT = 5  # seconds to wait for another shard to release the database
 
 # Embed
 EMBED_EVENT_DESCRIPTION = "N'oubliez pas de pointer [ici](http://domain.tld/path) !\n" \
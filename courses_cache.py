@@ -0,0 +1,78 @@
+# Variables
+import config
+
+# Custom modules
+import tools
+from event_index import EventRecord
+
+import arrow
+import asyncio
+import logging
+import time
+import typing
+
+
+class CoursesCache:
+    """
+    Caches the list of courses of the day, indexed by their (start, end) time slot.
+    Concurrent lookups share the same request to the API.
+    """
+    def __init__(self, ttl: float = None, logger: logging.Logger = logging.getLogger("CoursesCache")):
+        """
+
+        :param ttl: The number of seconds the courses are kept, defaults to config.COURSES_CACHE_TTL
+        :param logger: An optional logger
+        """
+        self.ttl = config.COURSES_CACHE_TTL if ttl is None else ttl
+        self.logger = logger
+
+        self._courses: typing.List[dict] = list()
+        # (start, end) : courses
+        self._slots: typing.Dict[typing.Tuple[str, str], typing.List[dict]] = dict()
+        self._day: typing.Union[str, None] = None
+        self._fetched_at = 0.
+        self._fetch: typing.Union[asyncio.Future, None] = None
+
+    def invalidate(self) -> None:
+        self._day = None
+
+    def _is_valid(self) -> bool:
+        return self._day == arrow.now(config.TIMEZONE).format("YYYY-MM-DD") and \
+               time.monotonic() - self._fetched_at < self.ttl
+
+    async def get_courses(self) -> typing.List[dict]:
+        """
+        Gets the courses, from the API if they aren't cached
+        :return: The courses, empty if the API couldn't be reached
+        """
+        if self._is_valid():
+            return self._courses
+        if self._fetch is None:
+            self._fetch = asyncio.ensure_future(self._refresh())
+        return await asyncio.shield(self._fetch)
+
+    async def _refresh(self) -> typing.List[dict]:
+        day = arrow.now(config.TIMEZONE).format("YYYY-MM-DD")
+        try:
+            courses = await tools.get_courses(self.logger)
+        finally:
+            self._fetch = None
+        self.logger.debug(f"Got {len(courses)} course(s): {', '.join([course['name'] for course in courses])}")
+        slots = dict()
+        for course in courses:
+            slots.setdefault((course["start"], course["end"]), list()).append(course)
+        self._courses, self._slots = courses, slots
+        # An empty list most likely means the API couldn't be reached, don't keep it
+        if courses:
+            self._day = day
+            self._fetched_at = time.monotonic()
+        return courses
+
+    async def get_event_courses(self, event: EventRecord) -> typing.List[dict]:
+        """
+        Gets the courses matching the time slot of an event
+        :param event: The calendar event
+        :return: The courses of the event
+        """
+        await self.get_courses()
+        return self._slots.get(tools.get_event_slot(event), list())
@@ -0,0 +1,77 @@
+# Variables
+import config
+
+# Custom modules
+import metrics
+
+import discord
+import asyncio
+import logging
+import time
+import typing
+
+
+class EmbedUpdater:
+    """
+    Coalesces the updates of a message: requests made while an edit is pending or too close to the
+    previous one are merged, so the message is edited at most once per window and always with the latest state
+    """
+    def __init__(self,
+                 edit: typing.Callable[[], typing.Awaitable[None]],
+                 window: float = None,
+                 logger: logging.Logger = logging.getLogger("EmbedUpdater")):
+        """
+
+        :param edit: The coroutine function editing the message with the current state
+        :param window: The minimum number of seconds between two edits, defaults to config.EMBED_UPDATE_WINDOW
+        :param logger: An optional logger
+        """
+        self.edit = edit
+        self.window = config.EMBED_UPDATE_WINDOW if window is None else window
+        self.logger = logger
+
+        self._last_flush = 0.
+        # When the oldest update not shown yet was requested
+        self._pending_since: typing.Union[float, None] = None
+        self._task: typing.Union[asyncio.Task, None] = None
+
+    def request(self) -> None:
+        """
+        Requests the message to be edited with the current state
+        :return: None
+        """
+        metrics.EMBED_UPDATE_REQUESTS.inc()
+        if self._pending_since is None:
+            self._pending_since = time.monotonic()
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._flush())
+
+    def cancel(self) -> None:
+        """
+        Drops the pending update, if any
+        :return: None
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._pending_since = None
+
+    async def _flush(self) -> None:
+        delay = self._last_flush + self.window - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        pending_since, self._pending_since = self._pending_since, None
+        try:
+            await self.edit()
+            metrics.EMBED_EDITS.inc()
+            metrics.EMBED_FLUSH_SECONDS.observe(time.monotonic() - pending_since)
+        except discord.HTTPException as e:
+            self.logger.error(f"Couldn't update the message: {e}")
+        except Exception as e:
+            self.logger.exception(f"Unexpected error while updating the message: {e}")
+        finally:
+            self._last_flush = time.monotonic()
+            self._task = None
+            # Updates requested during the edit
+            if self._pending_since is not None:
+                self._task = asyncio.ensure_future(self._flush())
@@ -0,0 +1,180 @@
+# Variables
+import config
+
+from array import array
+from bisect import bisect_left, bisect_right
+import arrow
+import typing
+
+
+class EventRecord:
+    """
+    The fields of a calendar event used by the bot, the dates are only turned into Arrow objects when needed
+    """
+    __slots__ = ("uid", "name", "location", "begin_ts", "end_ts", "version")
+
+    def __init__(self, uid: str, name: typing.Union[str, None], location: typing.Union[str, None],
+                 begin_ts: float, end_ts: float, version: str = ""):
+        """
+
+        :param uid: The uid of the event
+        :param name: The name of the event
+        :param location: The location of the event
+        :param begin_ts: The epoch timestamp of the beginning of the event
+        :param end_ts: The epoch timestamp of the end of the event
+        :param version: The sequence and last modification of the event, empty if the feed has neither
+        """
+        self.uid = uid
+        self.name = name
+        self.location = location
+        self.begin_ts = begin_ts
+        self.end_ts = end_ts
+        self.version = version
+
+    @property
+    def key(self) -> str:
+        """
+        The uid and beginning of the event, so that an event moved to another time is posted again
+        """
+        return f"{self.uid}@{self.begin_ts:.0f}"
+
+    def same_as(self, other: "EventRecord") -> bool:
+        """
+        :return: Whether or not the other version of the event is unchanged, without comparing the fields
+        when both have the same version
+        """
+        if self.version and self.version == other.version:
+            return True
+        return (self.name, self.location, self.begin_ts, self.end_ts) == \
+               (other.name, other.location, other.begin_ts, other.end_ts)
+
+    @property
+    def begin(self) -> arrow.Arrow:
+        return arrow.Arrow.utcfromtimestamp(self.begin_ts)
+
+    @property
+    def end(self) -> arrow.Arrow:
+        return arrow.Arrow.utcfromtimestamp(self.end_ts)
+
+
+class EventDiff:
+    """
+    The events added, removed and changed between two versions of a calendar
+    """
+    __slots__ = ("added", "removed", "changed")
+
+    def __init__(self):
+        self.added: typing.List[EventRecord] = list()
+        self.removed: typing.List[EventRecord] = list()
+        # (old, new)
+        self.changed: typing.List[typing.Tuple[EventRecord, EventRecord]] = list()
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.changed)
+
+    def __str__(self) -> str:
+        return f"{len(self.added)} added, {len(self.removed)} removed, {len(self.changed)} changed"
+
+
+class EventIndex:
+    """
+    An immutable index of the events of a calendar, sorted by their beginning,
+    so that the current, today's and next events are found with binary searches
+    instead of walking the whole timeline
+    """
+    __slots__ = ("begins", "ends", "uids", "events", "max_duration")
+
+    def __init__(self, events: typing.Iterable[EventRecord] = ()):
+        """
+
+        :param events: The events of the calendar, in any order
+        """
+        events = sorted(events, key=lambda e: (e.begin_ts, e.end_ts))
+        self.events: typing.List[EventRecord] = events
+        self.begins = array("d", (e.begin_ts for e in events))
+        self.ends = array("d", (e.end_ts for e in events))
+        self.uids: typing.List[str] = [e.uid for e in events]
+        # The longest event bounds how far back an event still happening can have started
+        self.max_duration = max((end - begin for begin, end in zip(self.begins, self.ends)), default=0)
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def at(self, timestamp: float) -> typing.List[EventRecord]:
+        """
+        Gets the events happening at the specified time
+        :param timestamp: The epoch timestamp
+        :return: The events which began before and end after the timestamp, sorted by their beginning
+        """
+        lo = bisect_left(self.begins, timestamp - self.max_duration)
+        hi = bisect_right(self.begins, timestamp)
+        return [self.events[i] for i in range(lo, hi) if self.ends[i] > timestamp]
+
+    def included(self, start: float, stop: float) -> typing.List[EventRecord]:
+        """
+        Gets the events which begin and end between the two specified times
+        :param start: The epoch timestamp of the beginning of the range
+        :param stop: The epoch timestamp of the end of the range
+        :return: The events included in the range, sorted by their beginning
+        """
+        lo = bisect_left(self.begins, start)
+        hi = bisect_left(self.begins, stop)
+        return [self.events[i] for i in range(lo, hi) if self.ends[i] <= stop]
+
+    def after(self, timestamp: float) -> typing.Union[EventRecord, None]:
+        """
+        Gets the first event beginning after the specified time
+        :param timestamp: The epoch timestamp
+        :return: The next event, None if there is none
+        """
+        i = bisect_right(self.begins, timestamp)
+        return self.events[i] if i < len(self.events) else None
+
+    def beginning(self, start: float, stop: float) -> typing.List[EventRecord]:
+        """
+        Gets the events which begin after the first specified time and until the second one
+        :param start: The epoch timestamp of the beginning of the range, excluded
+        :param stop: The epoch timestamp of the end of the range, included
+        :return: The events beginning in the range, sorted by their beginning
+        """
+        lo = bisect_right(self.begins, start)
+        hi = bisect_right(self.begins, stop)
+        return self.events[lo:hi]
+
+    def find(self, uid: str) -> typing.Union[EventRecord, None]:
+        """
+        Gets an event by its uid
+        :param uid: The uid of the event
+        :return: The event, None if it is not in the calendar
+        """
+        try:
+            return self.events[self.uids.index(uid)]
+        except ValueError:
+            return None
+
+    def diff(self, old: "EventIndex") -> EventDiff:
+        """
+        Compares the events with those of a previous version of the calendar, matched by their uid
+        :param old: The previous version
+        :return: The changes since the previous version
+        """
+        diff = EventDiff()
+        old_events = dict(zip(old.uids, old.events))
+        for event in self.events:
+            old_event = old_events.pop(event.uid, None)
+            if old_event is None:
+                diff.added.append(event)
+            elif not event.same_as(old_event):
+                diff.changed.append((old_event, event))
+        diff.removed.extend(old_events.values())
+        return diff
+
+    def now(self) -> typing.List[EventRecord]:
+        return self.at(arrow.now(config.TIMEZONE).float_timestamp)
+
+    def today(self) -> typing.List[EventRecord]:
+        today = arrow.now(config.TIMEZONE)
+        return self.included(today.floor("day").float_timestamp, today.ceil("day").float_timestamp)
+
+    def next(self) -> typing.Union[EventRecord, None]:
+        return self.after(arrow.now(config.TIMEZONE).float_timestamp)
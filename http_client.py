@@ -0,0 +1,116 @@
+# Variables
+import config
+
+import asyncio
+import json
+import typing
+import logging
+import aiohttp
+from multidict import CIMultiDictProxy
+
+# Status codes worth retrying, anything else is returned to the caller as is
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_session: typing.Union[aiohttp.ClientSession, None] = None
+_logger = logging.getLogger("http")
+
+
+class HTTPError(Exception):
+    """
+    Raised when a request could not be completed or returned an error status code
+    """
+    def __init__(self, message: str, status: typing.Union[int, None] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class Response:
+    """
+    The fully read response of a request, so that the connection can go back to the pool right away
+    """
+    __slots__ = ("url", "status", "headers", "body")
+
+    def __init__(self, url: str, status: int, headers: CIMultiDictProxy, body: bytes):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @property
+    def text(self) -> str:
+        return self.body.decode("utf-8", errors="replace")
+
+    def json(self) -> typing.Any:
+        return json.loads(self.body)
+
+    def raise_for_status(self) -> None:
+        if self.status >= 400:
+            raise HTTPError(f"{self.status} error for url {self.url}", self.status)
+
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Gets the shared session, creating it on first use so that it is bound to the running event loop
+    :return: The shared session
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=config.HTTP_CONNECTION_LIMIT,
+                                         limit_per_host=config.HTTP_CONNECTION_LIMIT_PER_HOST,
+                                         keepalive_timeout=config.HTTP_KEEPALIVE_TIMEOUT)
+        _session = aiohttp.ClientSession(connector=connector,
+                                         timeout=aiohttp.ClientTimeout(total=config.HTTP_TIMEOUT))
+    return _session
+
+
+async def close_session() -> None:
+    """
+    Closes the shared session and its pooled connections
+    :return: None
+    """
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def request(method: str,
+                  url: str,
+                  retries: int = None,
+                  logger: logging.Logger = _logger,
+                  **kwargs) -> Response:
+    """
+    Sends a request with the shared session, retrying with an exponential backoff on network errors,
+    timeouts and transient status codes
+    :param method: The HTTP method
+    :param url: The URL to request
+    :param retries: The number of retries after the first attempt, defaults to config.HTTP_RETRIES
+    :param logger: An optional logger
+    :param kwargs: The arguments passed to aiohttp.ClientSession.request
+    :return: The response of the last attempt
+    :raises HTTPError: If no response could be obtained
+    """
+    retries = config.HTTP_RETRIES if retries is None else retries
+    delay = config.HTTP_RETRY_BACKOFF
+    for attempt in range(retries + 1):
+        last_attempt = attempt == retries
+        try:
+            async with get_session().request(method, url, **kwargs) as r:
+                response = Response(str(r.url), r.status, r.headers, await r.read())
+            if response.status not in RETRY_STATUSES or last_attempt:
+                return response
+            logger.debug(f"{method} {url} returned {response.status}, retrying in {delay}s")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if last_attempt:
+                raise HTTPError(f"{method} {url} failed: {e!r}") from e
+            logger.debug(f"{method} {url} failed ({e!r}), retrying in {delay}s")
+        await asyncio.sleep(delay)
+        delay *= 2
+
+
+async def get(url: str, **kwargs) -> Response:
+    return await request("GET", url, **kwargs)
+
+
+async def post(url: str, **kwargs) -> Response:
+    return await request("POST", url, **kwargs)
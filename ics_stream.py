@@ -0,0 +1,159 @@
+# Variables
+import config
+
+from event_index import EventRecord
+
+from datetime import datetime, timedelta, tzinfo
+from dateutil import tz
+import hashlib
+import re
+import typing
+
+DURATION_REGEX = re.compile(r"([-+])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$")
+ESCAPE_REGEX = re.compile(r"\\([\\;,nN])")
+
+# The properties of a VEVENT we keep, the others are skipped without being decoded
+PROPERTIES = ("UID", "SUMMARY", "LOCATION", "DTSTART", "DTEND", "DURATION", "SEQUENCE", "LAST-MODIFIED")
+
+
+def unfold(lines: typing.Iterable[str]) -> typing.Iterator[str]:
+    """
+    Joins the folded lines of an iCalendar stream, without reading the whole stream
+    :param lines: The raw lines
+    :return: The logical lines
+    """
+    current = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t"):
+            if current is not None:
+                current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+def split_property(line: str) -> typing.Tuple[str, typing.Dict[str, str], str]:
+    """
+    Splits a content line into its name, parameters and value
+    :param line: The unfolded line, e.g. DTSTART;TZID=Europe/Paris:20210924T080000
+    :return: The upper-cased name, the parameters and the raw value
+    """
+    quoted = False
+    for i, char in enumerate(line):
+        if char == '"':
+            quoted = not quoted
+        elif char == ":" and not quoted:
+            break
+    else:
+        return line.upper(), dict(), ""
+    name, *params = line[:i].split(";")
+    return name.upper(), dict(p.split("=", 1) for p in params if "=" in p), line[i + 1:]
+
+
+def unescape(value: str) -> str:
+    return ESCAPE_REGEX.sub(lambda m: "\n" if m.group(1) in "nN" else m.group(1), value)
+
+
+def parse_date(value: str, params: typing.Dict[str, str], default_tz: tzinfo) -> typing.Tuple[float, bool]:
+    """
+    Parses a DATE or DATE-TIME value
+    :param value: The value, e.g. 20210924T080000Z
+    :param params: The parameters of the property, for the TZID and VALUE
+    :param default_tz: The timezone of the floating times and of those with an unknown TZID
+    :return: The epoch timestamp and whether or not it is a whole day
+    """
+    value = value.strip()
+    if params.get("VALUE") == "DATE" or len(value) == 8:
+        return datetime.strptime(value[:8], "%Y%m%d").replace(tzinfo=default_tz).timestamp(), True
+    if value.endswith("Z"):
+        return datetime.strptime(value[:15], "%Y%m%dT%H%M%S").replace(tzinfo=tz.UTC).timestamp(), False
+    zone = tz.gettz(params["TZID"].strip('"')) if "TZID" in params else None
+    return datetime.strptime(value[:15], "%Y%m%dT%H%M%S").replace(tzinfo=zone or default_tz).timestamp(), False
+
+
+def parse_duration(value: str) -> float:
+    """
+    Parses a DURATION value
+    :param value: The value, e.g. PT1H30M
+    :return: The number of seconds
+    """
+    match = DURATION_REGEX.match(value.strip())
+    if not match:
+        raise ValueError(f"Invalid duration {value}")
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = timedelta(weeks=int(weeks or 0), days=int(days or 0),
+                         hours=int(hours or 0), minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -duration.total_seconds() if sign == "-" else duration.total_seconds()
+
+
+def _make_event(properties: typing.Dict[str, typing.Tuple[typing.Dict[str, str], str]],
+                default_tz: tzinfo) -> typing.Union[EventRecord, None]:
+    if "DTSTART" not in properties:
+        return None
+    begin_ts, whole_day = parse_date(properties["DTSTART"][1], properties["DTSTART"][0], default_tz)
+    if "DTEND" in properties:
+        end_ts, _ = parse_date(properties["DTEND"][1], properties["DTEND"][0], default_tz)
+    elif "DURATION" in properties:
+        end_ts = begin_ts + parse_duration(properties["DURATION"][1])
+    else:
+        # RFC 5545: a date lasts one day, a date-time has no duration
+        end_ts = begin_ts + (24 * 60 * 60 if whole_day else 0)
+
+    name = unescape(properties["SUMMARY"][1]) if "SUMMARY" in properties else None
+    location = unescape(properties["LOCATION"][1]) if "LOCATION" in properties else None
+    if "UID" in properties:
+        uid = properties["UID"][1]
+    else:
+        uid = hashlib.sha1(f"{begin_ts}{name}{location}".encode("utf-8")).hexdigest()
+    if "SEQUENCE" in properties or "LAST-MODIFIED" in properties:
+        version = f"{properties.get('SEQUENCE', ({}, ''))[1]}:{properties.get('LAST-MODIFIED', ({}, ''))[1]}"
+    else:
+        version = ""
+    return EventRecord(uid, name, location, begin_ts, end_ts, version)
+
+
+def parse_events(lines: typing.Iterable[str],
+                 start: float,
+                 stop: float,
+                 default_timezone: str = None) -> typing.List[EventRecord]:
+    """
+    Parses the events of an iCalendar stream line by line, keeping only those overlapping the window,
+    without building the whole calendar in memory
+    :param lines: The lines of the stream, e.g. a file or an io.StringIO
+    :param start: The epoch timestamp of the beginning of the window
+    :param stop: The epoch timestamp of the end of the window
+    :param default_timezone: The timezone of the floating times, defaults to config.TIMEZONE
+    :return: The events in the window, in the order of the stream
+    """
+    default_tz = tz.gettz(default_timezone or config.TIMEZONE)
+    events = list()
+    properties: typing.Union[dict, None] = None
+    # Depth of the components nested in the current event, such as VALARM
+    nested = 0
+
+    for line in unfold(lines):
+        if properties is None:
+            if line.upper() == "BEGIN:VEVENT":
+                properties = dict()
+            continue
+
+        name, params, value = split_property(line)
+        if name == "BEGIN":
+            nested += 1
+        elif name == "END" and nested:
+            nested -= 1
+        elif name == "END":
+            try:
+                event = _make_event(properties, default_tz)
+            except ValueError:
+                event = None
+            if event is not None and event.end_ts >= start and event.begin_ts <= stop:
+                events.append(event)
+            properties = None
+        elif not nested and name in PROPERTIES:
+            properties[name] = (params, value)
+    return events
@@ -0,0 +1,134 @@
+# Variables
+import config
+
+# Custom modules
+from live_session import LiveSession
+from persistence import write_atomic
+
+import asyncio
+import json
+import logging
+import os
+import typing
+
+
+class SessionJournal:
+    """
+    An append-only log of the live sessions: opened messages, check-in outcomes, closed messages and last events.
+    Records are written right away but only synced to disk in batches, and the log is replayed once at startup,
+    then compacted down to what is still live.
+    """
+    def __init__(self, file: str = None, logger: logging.Logger = logging.getLogger("Journal")):
+        """
+
+        :param file: The file of the journal, defaults to config.SESSIONS_JOURNAL_FILE
+        :param logger: An optional logger
+        """
+        self.file = config.SESSIONS_JOURNAL_FILE if file is None else file
+        self.logger = logger
+
+        # calendar_id : event uid
+        self.last_events: typing.Dict[str, str] = dict()
+        # message_id : the record of the opened session, with the ids of the users who checked-in under "reacted"
+        # and its check-in records under "check_ins"
+        self.sessions: typing.Dict[int, dict] = dict()
+
+        self._fd: typing.Union[typing.TextIO, None] = None
+        self._dirty = False
+        self._task: typing.Union[asyncio.Task, None] = None
+
+    def replay(self) -> None:
+        """
+        Rebuilds the state from the journal, then compacts it and opens it for appending
+        :return: None
+        """
+        try:
+            with open(self.file, "r", encoding="utf-8") as fd:
+                for line in fd:
+                    try:
+                        self._apply(json.loads(line))
+                    except (json.JSONDecodeError, KeyError, TypeError):
+                        # Most likely the last record, cut by a crash
+                        self.logger.warning(f"Skipping invalid journal record: {line!r}")
+        except IOError:
+            pass
+        self.logger.debug(f"Replayed the journal, {len(self.sessions)} live session(s)")
+        self._compact()
+
+    def _apply(self, record: dict) -> None:
+        kind = record["type"]
+        if kind == "last_event":
+            self.last_events[record["calendar"]] = record["event"]
+        elif kind == "open":
+            self.sessions[record["message_id"]] = dict(record, reacted=set(), check_ins=list())
+        elif kind == "update":
+            session = self.sessions.get(record["message_id"])
+            if session is not None:
+                # The check-ins are kept, the session is still opened
+                session.update((key, value) for key, value in record.items() if key != "type")
+        elif kind == "check_in":
+            session = self.sessions.get(record["message_id"])
+            if session is not None:
+                session["check_ins"].append(record)
+                if record["status"]:
+                    session["reacted"].add(record["user_id"])
+        elif kind == "close":
+            self.sessions.pop(record["message_id"], None)
+
+    def _compact(self) -> None:
+        if self._fd is not None:
+            self._fd.close()
+        records = [{"type": "last_event", "calendar": cal_id, "event": uid} for cal_id, uid in self.last_events.items()]
+        for session in self.sessions.values():
+            records.append({key: value for key, value in session.items() if key not in ("reacted", "check_ins")})
+            records.extend(session["check_ins"])
+        write_atomic(self.file, "".join(json.dumps(record) + "\n" for record in records).encode("utf-8"))
+        self._fd = open(self.file, "a", encoding="utf-8")
+
+    def _append(self, record: dict) -> None:
+        self._apply(record)
+        self._fd.write(json.dumps(record) + "\n")
+        self._dirty = True
+
+    def set_last_event(self, calendar_id: str, key: str) -> None:
+        self._append({"type": "last_event", "calendar": calendar_id, "event": key})
+
+    def open_session(self, session: LiveSession) -> None:
+        self._append(dict(session.to_dict(), type="open", calendar=session.calendar_id))
+
+    def update_session(self, session: LiveSession) -> None:
+        self._append(dict(session.to_dict(), type="update"))
+
+    def check_in(self, message_id: int, user_id: int, course_id: typing.Union[int, str], status: bool) -> None:
+        self._append({"type": "check_in", "message_id": message_id, "user_id": user_id,
+                      "course_id": course_id, "status": status})
+
+    def close_session(self, message_id: int) -> None:
+        self._append({"type": "close", "message_id": message_id})
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._sync_loop())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.sync()
+        self._fd.close()
+
+    async def _sync_loop(self) -> None:
+        while True:
+            await asyncio.sleep(config.SESSIONS_JOURNAL_SYNC_INTERVAL)
+            await self.sync()
+
+    async def sync(self) -> None:
+        """
+        Syncs the records written since the last sync to the disk, in a thread
+        :return: None
+        """
+        if not self._dirty:
+            return
+        self._dirty = False
+        self._fd.flush()
+        await asyncio.get_event_loop().run_in_executor(None, os.fsync, self._fd.fileno())
@@ -0,0 +1,66 @@
+# Custom modules
+import tools
+from embed_updater import EmbedUpdater
+from event_index import EventRecord
+
+import discord
+import asyncio
+import typing
+
+
+class LiveSession:
+    """
+    An event message students can still react to in order to check-in
+    """
+    def __init__(self,
+                 calendar_id: str,
+                 event: EventRecord,
+                 channel_id: int,
+                 message_id: int,
+                 courses: typing.List[dict],
+                 embed: tools.EventEmbed,
+                 ends_at: float,
+                 content: str = "",
+                 message: typing.Union[discord.Message, None] = None,
+                 persistent: bool = True):
+        """
+
+        :param calendar_id: The id of the calendar the event is part of
+        :param event: The calendar event
+        :param channel_id: The id of the channel the message was sent to
+        :param message_id: The id of the message
+        :param courses: The courses to check-in to
+        :param embed: The embed of the event
+        :param ends_at: The epoch timestamp after which reactions are no longer accepted
+        :param content: The content of the message, kept when editing it
+        :param message: The message, if available, it is fetched otherwise
+        :param persistent: Whether or not the session is saved, so that it is resumed after a restart
+        """
+        self.calendar_id = calendar_id
+        self.event = event
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.courses = courses
+        self.embed = embed
+        self.ends_at = ends_at
+        self.content = content
+        self.message = message
+        self.persistent = persistent
+
+        # The ids of the users who checked-in
+        self.reacted: typing.Set[int] = set()
+        # The ids of the users whose check-in is being submitted
+        self.checking_in: typing.Set[int] = set()
+        # The task closing the session once it ends
+        self.task: typing.Union[asyncio.Task, None] = None
+        # Coalesces the updates of the counter of the message
+        self.updater: typing.Union[EmbedUpdater, None] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "event": self.event.uid,
+            "channel_id": self.channel_id,
+            "message_id": self.message_id,
+            "ends_at": self.ends_at,
+            "content": self.content
+        }
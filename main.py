@@ -5,13 +5,23 @@ import config
 
 # Custom modules
 import tools
+import metrics
 from cogs.calendar import CalendarCog
+from live_session import LiveSession
+from students import StudentRegistry
+from shared_state import SharedState
 
 import discord
 from discord.ext import commands
-import asyncio
+import subprocess
+import sys
+import time
 
-bot = commands.Bot(command_prefix="!")
+args = tools.parse_args()
+# A sharded bot only connects to the gateway as its own shard
+bot = commands.Bot(command_prefix="!",
+                   shard_id=args.shard_id,
+                   shard_count=args.shard_count if args.shard_id is not None else None)
 
 
 async def is_admin(ctx):
@@ -27,7 +37,7 @@ async def on_ready():
 @bot.command(name="list")
 @commands.check(is_admin)
 async def _cmd_list_calendars(ctx: commands.Context):
-    message = "\n".join(calCog.calendars)
+    message = "\n".join(calCog.states)
     await ctx.send(message)
 
 
@@ -35,48 +45,78 @@ async def _cmd_list_calendars(ctx: commands.Context):
 @commands.check(is_admin)
 async def _debug(ctx: commands.Context, calendar: str, mode: str = "now"):
     # Check if the calendar exists
-    if calendar not in calCog.calendars:
+    if calendar not in calCog.states:
         return await ctx.send(":x: Unknown calendar")
+    state = calCog.states[calendar]
 
+    index = state.index
     if mode in ("now", "n"):
-        event = list(calCog.calendars[calendar].timeline.now())[0]
-    elif mode in ("today", "t"):
-        event = list(calCog.calendars[calendar].timeline.today())[0]
+        events = index.now()
+    elif mode in ("next", "x"):
+        events = [e for e in (index.next(),) if e]
     else:
-        event = list(calCog.calendars[calendar].timeline.today())[0]
+        events = index.today()
+    if not events:
+        return await ctx.send(":x: No event found")
+    event = events[0]
 
-    embed = tools.generate_event_embed(event, (0, len(students)), calCog.calendars_data[calendar])
-    bot_message: discord.Message = await ctx.send(embed=embed)
+    event_embed = tools.EventEmbed(event, state.data)
+    bot_message: discord.Message = await ctx.send(embed=event_embed.render((0, students.roster_size(calendar))))
     await bot_message.add_reaction(config.REACTION_EMOJI)
 
-    calCog.reacted[calendar] = set()  # The users who reacted
-    courses = tools.get_courses()
-    logger.debug(f"Got {len(courses)} course(s): {', '.join([course['name'] for course in courses])}")
-
-    def check(_reaction: discord.Reaction, _user: discord.User):
-        return _reaction.message == bot_message and \
-               str(_user.id) in students and \
-               str(_reaction.emoji) == config.REACTION_EMOJI and \
-               _user not in calCog.reacted[calendar]
-
-    try:
-        while len(calCog.reacted[calendar]) != len(students):
-            reaction, user = await bot.wait_for('reaction_add', timeout=config.REACTION_TIMEOUT, check=check)
-            bot.loop.create_task(calCog.check_in(user, courses, event, calendar, bot_message))
-    except asyncio.TimeoutError:
-        logger.info("Cancelled")
-        embed = tools.generate_event_embed(event, (len(calCog.reacted[calendar]), len(students)), calCog.calendars_data[calendar], finished=True)
-        await bot_message.edit(embed=embed)
-        await bot_message.add_reaction(config.CANCELLED_EMOJI)
-    else:
-        pass
+    courses = await calCog.courses.get_courses()
+
+    session = LiveSession(calendar, event, ctx.channel.id, bot_message.id, courses, event_embed,
+                          time.time() + config.REACTION_TIMEOUT, message=bot_message, persistent=False)
+    await calCog.open_session(session)
+
+
+@bot.command(name="stats")
+@commands.check(is_admin)
+async def _stats(ctx: commands.Context):
+    message = ":bar_chart: **Stats:**\n"
+    message += f"Event loop lag: {metrics.LOOP_LAG_SECONDS.get() * 1000:.1f} ms\n"
+    for metric in metrics.REGISTRY:
+        if isinstance(metric, metrics.Histogram):
+            count, average, p99 = metric.summary()
+            if count:
+                message += f"`{metric.name}`: {count}, average {average * 1000:.1f} ms, p99 ≤ {p99 * 1000:.0f} ms\n"
+    message += f"Event message edits saved: {metrics.EMBED_EDITS_SAVED.get():.0f}\n"
+    await ctx.send(message)
 
 
 if __name__ == '__main__':
-    args = tools.parse_args()
     logger = tools.get_logger(name="bot", level=args.log_level)
-    students = tools.load_students(config.STUDENTS_FILE)
     calendars_config = tools.load_calendars_config(config.CALENDARS_CONFIG_FILE)
-    calCog = CalendarCog(bot, students, calendars_config["calendars"], args.enable_check_in, logger=logger)
+    calendars = calendars_config["calendars"]
+    if args.shard_count > 1:
+        missing = [cal["id"] for cal in calendars if "guild_id" not in cal]
+        if missing:
+            logger.critical(f"The guild_id of calendar(s) {', '.join(missing)} is required to run several shards")
+            sys.exit(1)
+
+    if args.shard_count > 1 and args.shard_id is None:
+        # Run each shard in its own process
+        processes = [subprocess.Popen([sys.executable] + sys.argv + ["--shard-id", str(shard_id)])
+                     for shard_id in range(args.shard_count)]
+        try:
+            for process in processes:
+                process.wait()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+        sys.exit()
+
+    shared_state = None
+    if args.shard_id is not None:
+        calendars = [cal for cal in calendars if tools.get_calendar_shard(cal, args.shard_count) == args.shard_id]
+        shared_state = SharedState(shard_id=args.shard_id, logger=logger)
+        logger.info(f"Running shard {args.shard_id}/{args.shard_count} with {len(calendars)} calendar(s)")
+    students = StudentRegistry(config.STUDENTS_FILE, [cal["id"] for cal in calendars], logger=logger)
+    calCog = CalendarCog(bot, students, calendars, args.enable_check_in, logger=logger, shared_state=shared_state)
     bot.add_cog(calCog)
+    bot.loop.create_task(metrics.monitor_loop_lag())
+    if config.METRICS_PORT:
+        # One port per shard
+        bot.loop.create_task(metrics.start_server(port=config.METRICS_PORT + (args.shard_id or 0)))
     bot.run(config.BOT_TOKEN)
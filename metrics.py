@@ -0,0 +1,242 @@
+# Variables
+import config
+
+from abc import ABC, abstractmethod
+from aiohttp import web
+from bisect import bisect_left
+import asyncio
+import functools
+import inspect
+import time
+import typing
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = typing.Tuple[str, ...]
+
+REGISTRY: typing.List["Metric"] = list()
+
+
+def _format_labels(names: Labels, values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labels: Labels = ()):
+        """
+
+        :param name: The name of the metric, prefixed by config.METRICS_PREFIX when exposed
+        :param description: The description of the metric
+        :param labels: The names of the labels of the metric
+        """
+        self.name = config.METRICS_PREFIX + name
+        self.description = description
+        self.labels = labels
+        REGISTRY.append(self)
+
+    def _key(self, labels: typing.Dict[str, str]) -> Labels:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    @abstractmethod
+    def samples(self) -> typing.Iterator[typing.Tuple[str, str, float]]:
+        """
+        :return: The name, formatted labels and value of each sample
+        """
+
+    def expose(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{name}{labels} {value}" for name, labels, value in self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: Labels = ()):
+        super().__init__(name, description, labels)
+        self.values: typing.Dict[Labels, float] = dict()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def total(self) -> float:
+        return sum(self.values.values())
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, _format_labels(self.labels, key), value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, labels: Labels = (), function: typing.Callable[[], float] = None):
+        """
+
+        :param function: An optional function returning the value of the gauge when it is exposed, without labels
+        """
+        super().__init__(name, description, labels)
+        self.values: typing.Dict[Labels, float] = dict()
+        self.function = function
+
+    def set(self, value: float, **labels) -> None:
+        self.values[self._key(labels)] = value
+
+    def get(self, **labels) -> float:
+        if self.function is not None:
+            return self.function()
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self):
+        if self.function is not None:
+            yield self.name, "", self.function()
+            return
+        for key, value in self.values.items():
+            yield self.name, _format_labels(self.labels, key), value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: Labels = (), buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+        # labels : (count of each bucket, the last one being +Inf, sum)
+        self.values: typing.Dict[Labels, typing.List] = dict()
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        counts, _ = self.values.setdefault(key, [[0] * (len(self.buckets) + 1), 0.])
+        counts[bisect_left(self.buckets, value)] += 1
+        self.values[key][1] += value
+
+    def time(self, **labels):
+        """
+        Decorates a function, or a coroutine function, to observe how long it takes
+        :param labels: The labels of the observations
+        :return: The decorator
+        """
+        def decorator(function):
+            if inspect.iscoroutinefunction(function):
+                @functools.wraps(function)
+                async def wrapper(*args, **kwargs):
+                    start = time.perf_counter()
+                    try:
+                        return await function(*args, **kwargs)
+                    finally:
+                        self.observe(time.perf_counter() - start, **labels)
+            else:
+                @functools.wraps(function)
+                def wrapper(*args, **kwargs):
+                    start = time.perf_counter()
+                    try:
+                        return function(*args, **kwargs)
+                    finally:
+                        self.observe(time.perf_counter() - start, **labels)
+            return wrapper
+        return decorator
+
+    def summary(self) -> typing.Tuple[int, float, float]:
+        """
+        :return: The number of observations, their average and the upper bound of the bucket of their 99th percentile,
+        for all the labels together
+        """
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0.
+        for bucket_counts, bucket_sum in self.values.values():
+            counts = [a + b for a, b in zip(counts, bucket_counts)]
+            total += bucket_sum
+        count = sum(counts)
+        if not count:
+            return 0, 0., 0.
+        seen = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            seen += bucket_count
+            if seen >= 0.99 * count:
+                return count, total / count, bound
+        return count, total / count, float("inf")
+
+    def samples(self):
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else str(bound)
+                yield f"{self.name}_bucket", _format_labels(self.labels, key, f'le="{le}"'), cumulative
+            yield f"{self.name}_count", _format_labels(self.labels, key), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labels, key), total
+
+
+# Calendars
+CALENDAR_UPDATE_SECONDS = Histogram("calendar_update_seconds", "Time spent updating a calendar", ("status",))
+CALENDAR_PARSE_SECONDS = Histogram("calendar_parse_seconds", "Time spent parsing a calendar feed")
+GET_NEW_EVENTS_SECONDS = Histogram("get_new_events_seconds", "Time spent looking for the new events of a calendar",
+                                   buckets=(.00001, .0001, .001, .01, .1))
+SEND_EVENT_SECONDS = Histogram("send_event_seconds", "Time spent posting an event")
+
+# Check-ins
+CHECK_IN_SECONDS = Histogram("check_in_seconds", "Time between a reaction and the status DMs of the student being queued")
+CHECK_IN_API_SECONDS = Histogram("check_in_api_seconds", "Latency of the check-in API", ("outcome",))
+COURSES_API_SECONDS = Histogram("courses_api_seconds", "Latency of the courses API", ("outcome",))
+
+# Embeds
+EMBED_RENDER_SECONDS = Histogram("embed_render_seconds", "Time spent rendering an event embed", ("kind",),
+                                 buckets=(.00001, .0001, .001, .01, .1))
+
+EMBED_UPDATE_REQUESTS = Counter("embed_update_requests_total", "Updates of event messages requested")
+EMBED_EDITS = Counter("embed_edits_total", "Edits of event messages actually sent")
+EMBED_EDITS_SAVED = Gauge("embed_edits_saved", "Updates of event messages merged into another edit",
+                          function=lambda: EMBED_UPDATE_REQUESTS.total() - EMBED_EDITS.total())
+EMBED_FLUSH_SECONDS = Histogram("embed_flush_seconds", "Time between an update request and the edit showing it")
+
+# Notifications
+NOTIFICATIONS = Counter("notifications_total", "Direct messages, by outcome", ("outcome",))
+
+# Event loop
+LOOP_LAG_SECONDS = Gauge("event_loop_lag_seconds", "How late the event loop ran the last lag probe")
+
+
+async def monitor_loop_lag(interval: float = None) -> None:
+    """
+    Measures how late the event loop wakes up a sleeping task, which is how long it was blocked
+    :param interval: The number of seconds between two probes, defaults to config.METRICS_LOOP_LAG_INTERVAL
+    :return: None
+    """
+    interval = config.METRICS_LOOP_LAG_INTERVAL if interval is None else interval
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        LOOP_LAG_SECONDS.set(max(time.perf_counter() - start - interval, 0))
+
+
+def expose() -> str:
+    """
+    :return: All the metrics, in the Prometheus text format
+    """
+    return "\n".join(metric.expose() for metric in REGISTRY) + "\n"
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=expose(), content_type="text/plain")
+
+
+async def start_server(host: str = None, port: int = None) -> web.AppRunner:
+    """
+    Serves the metrics on /metrics
+    :param host: The host to listen on, defaults to config.METRICS_HOST
+    :param port: The port to listen on, defaults to config.METRICS_PORT
+    :return: The runner of the server
+    """
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, config.METRICS_HOST if host is None else host,
+                      config.METRICS_PORT if port is None else port).start()
+    return runner
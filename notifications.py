@@ -0,0 +1,85 @@
+# Variables
+import config
+
+# Custom modules
+from metrics import NOTIFICATIONS
+
+import discord
+import asyncio
+import logging
+import time
+import typing
+
+
+class NotificationQueue:
+    """
+    Sends the direct messages with a bounded pool of workers, spaced out so that they stay under the rate limit.
+    The users whose direct messages are closed are remembered for a while, so that they aren't tried each time.
+    """
+    def __init__(self, logger: logging.Logger = logging.getLogger("Notifications")):
+        """
+
+        :param logger: An optional logger
+        """
+        self.logger = logger
+
+        self.queue: asyncio.Queue = asyncio.Queue()
+        # user_id : when their direct messages are tried again, as a time.monotonic() timestamp
+        self.closed: typing.Dict[int, float] = dict()
+        self.workers: typing.List[asyncio.Task] = list()
+        # When the next message can be sent, shared by the workers
+        self._next_send = 0.
+
+    def start(self) -> None:
+        if self.workers:
+            return
+        self.workers = [asyncio.ensure_future(self._work()) for _ in range(config.NOTIFICATION_WORKERS)]
+
+    def stop(self) -> None:
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = list()
+
+    def is_closed(self, user_id: int) -> bool:
+        expiry = self.closed.get(user_id)
+        if expiry is None:
+            return False
+        if expiry <= time.monotonic():
+            del self.closed[user_id]
+            return False
+        return True
+
+    def notify(self, user: discord.User, content: str) -> None:
+        """
+        Queues a direct message, dropped right away if the direct messages of the user are known to be closed
+        :param user: The user to send the message to
+        :param content: The content of the message
+        :return: None
+        """
+        if self.is_closed(user.id):
+            NOTIFICATIONS.inc(outcome="skipped")
+            return
+        self.queue.put_nowait((user, content))
+
+    async def _work(self) -> None:
+        while True:
+            user, content = await self.queue.get()
+            # Checked again, the first message to a closed user may have been sent meanwhile
+            if self.is_closed(user.id):
+                NOTIFICATIONS.inc(outcome="skipped")
+                continue
+            now = time.monotonic()
+            delay = self._next_send - now
+            self._next_send = max(now, self._next_send) + 1 / config.NOTIFICATION_RATE
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                await user.send(content)
+                NOTIFICATIONS.inc(outcome="sent")
+            except discord.errors.Forbidden:  # User's DMs are closed
+                self.logger.debug(f"Couldn't send DM to {user.display_name}, not trying again for a while")
+                self.closed[user.id] = time.monotonic() + config.NOTIFICATION_CLOSED_TTL
+                NOTIFICATIONS.inc(outcome="closed")
+            except discord.HTTPException as e:
+                self.logger.error(f"Couldn't send DM to {user.display_name}: {e}")
+                NOTIFICATIONS.inc(outcome="failed")
@@ -0,0 +1,128 @@
+# Variables
+import config
+
+import asyncio
+import gzip
+import logging
+import os
+import typing
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# compression : extension of the feed files
+FEED_EXTENSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def write_atomic(file: str, data: bytes) -> None:
+    """
+    Writes a file through a temporary file renamed over it, so that it is never seen half-written
+    :param file: The file to write
+    :param data: The content of the file
+    :return: None
+    """
+    tmp_file = file + ".tmp"
+    with open(tmp_file, "wb") as fd:
+        fd.write(data)
+        fd.flush()
+        os.fsync(fd.fileno())
+    os.replace(tmp_file, file)
+
+
+def get_feed_extension() -> str:
+    """
+    :return: The extension of the feed files, for config.CALENDAR_FEED_COMPRESSION
+    """
+    if config.CALENDAR_FEED_COMPRESSION == "zstd" and zstandard is None:
+        raise ValueError("CALENDAR_FEED_COMPRESSION is zstd but the zstandard package isn't installed")
+    return FEED_EXTENSIONS[config.CALENDAR_FEED_COMPRESSION]
+
+
+def write_feed(file: str, text: str) -> None:
+    """
+    Writes a feed, compressed according to the extension of the file
+    :param file: The file to write
+    :param text: The feed
+    :return: None
+    """
+    data = text.encode("utf-8")
+    if file.endswith(".gz"):
+        data = gzip.compress(data, compresslevel=6)
+    elif file.endswith(".zst"):
+        data = zstandard.ZstdCompressor().compress(data)
+    write_atomic(file, data)
+
+
+def read_feed(file: str) -> str:
+    """
+    Reads a feed, decompressed according to the extension of the file
+    :param file: The file to read
+    :return: The feed
+    :raises IOError: If the file can't be read
+    """
+    with open(file, "rb") as fd:
+        data = fd.read()
+    if file.endswith(".gz"):
+        data = gzip.decompress(data)
+    elif file.endswith(".zst"):
+        data = zstandard.ZstdDecompressor().decompress(data)
+    return data.decode("utf-8")
+
+
+class FileWriter:
+    """
+    Writes files atomically in a thread, so that the event loop isn't blocked by the disk.
+    The writes of a file requested while one is waiting are merged into it: only the latest content is written,
+    at most once per delay.
+    """
+    def __init__(self, delay: float = None, logger: logging.Logger = logging.getLogger("FileWriter")):
+        """
+
+        :param delay: The number of seconds a write waits for the next ones, defaults to config.STATE_WRITE_DELAY
+        :param logger: An optional logger
+        """
+        self.delay = config.STATE_WRITE_DELAY if delay is None else delay
+        self.logger = logger
+
+        # file : the function serializing its latest content
+        self._pending: typing.Dict[str, typing.Callable[[], bytes]] = dict()
+        self._tasks: typing.Dict[str, asyncio.Task] = dict()
+        # Set to write the pending files right away
+        self._now = asyncio.Event()
+
+    def request(self, file: str, serialize: typing.Callable[[], bytes]) -> None:
+        """
+        Requests a file to be written
+        :param file: The file to write
+        :param serialize: Returns the content of the file, only called when it is written so that it is up to date
+        :return: None
+        """
+        self._pending[file] = serialize
+        if file not in self._tasks:
+            self._tasks[file] = asyncio.ensure_future(self._write(file))
+
+    async def _write(self, file: str) -> None:
+        try:
+            await asyncio.wait_for(self._now.wait(), self.delay)
+        except asyncio.TimeoutError:
+            pass
+        try:
+            # Requested again while it was being written
+            while file in self._pending:
+                data = self._pending.pop(file)()
+                await asyncio.get_event_loop().run_in_executor(None, write_atomic, file, data)
+        except OSError as e:
+            self.logger.error(f"Couldn't write {file}: {e}")
+        finally:
+            del self._tasks[file]
+
+    async def flush(self) -> None:
+        """
+        Writes the pending files right away, e.g. before stopping
+        :return: None
+        """
+        self._now.set()
+        await asyncio.gather(*self._tasks.values())
+        self._now.clear()
@@ -0,0 +1,38 @@
+# Custom modules
+import tools
+from event_index import EventRecord
+
+import discord
+import typing
+
+
+class PreparedEvent:
+    """
+    Everything needed to post an event, resolved by the warmup before it begins
+    """
+    def __init__(self,
+                 event: EventRecord,
+                 channel: typing.Union[discord.TextChannel, None],
+                 role: typing.Union[discord.Role, None],
+                 embed: tools.EventEmbed,
+                 courses: typing.List[dict],
+                 problems: typing.List[str]):
+        """
+
+        :param event: The calendar event
+        :param channel: The channel to send the event to, None if it couldn't be found
+        :param role: The role to mention, None if disabled or if it couldn't be found
+        :param embed: The embed of the event
+        :param courses: The courses of the event
+        :param problems: What would prevent the event from being posted or checked-in to, reported to the admins
+        """
+        self.event = event
+        self.channel = channel
+        self.role = role
+        self.embed = embed
+        self.courses = courses
+        self.problems = problems
+
+    @property
+    def content(self) -> str:
+        return self.role.mention if self.role else ""
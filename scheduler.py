@@ -0,0 +1,95 @@
+from event_index import EventIndex
+
+import asyncio
+import heapq
+import logging
+import time
+import typing
+
+
+class EventScheduler:
+    """
+    Sleeps until the next event of any calendar begins instead of polling them.
+    The heap holds at most one trigger per calendar: the beginning of its next event, minus the lead.
+    """
+    def __init__(self,
+                 calendar_ids: typing.Iterable[str],
+                 get_index: typing.Callable[[str], EventIndex],
+                 callback: typing.Callable[[str], None],
+                 logger: logging.Logger = logging.getLogger("Scheduler"),
+                 lead: float = 0):
+        """
+
+        :param calendar_ids: The ids of the calendars to schedule
+        :param get_index: The function returning the current index of a calendar, called again on each trigger
+        :param callback: The function called with the id of a calendar when one of its events begins, must not block
+        :param logger: An optional logger
+        :param lead: The number of seconds before the beginning of the events the calendars are triggered
+        """
+        self.calendar_ids = list(calendar_ids)
+        self.get_index = get_index
+        self.callback = callback
+        self.logger = logger
+        self.lead = lead
+
+        # (timestamp, generation, calendar_id), triggers of an older generation than their calendar's are stale
+        self._heap: typing.List[typing.Tuple[float, int, str]] = list()
+        self._generations: typing.Dict[str, int] = dict()
+        self._wakeup = asyncio.Event()
+        self._task: typing.Union[asyncio.Task, None] = None
+
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        for cal_id in self.calendar_ids:
+            self.reschedule(cal_id)
+        self._task = asyncio.ensure_future(self.run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    def reschedule(self, calendar_id: str) -> None:
+        """
+        Drops the pending trigger of a calendar and checks it right away, to be called whenever it changes
+        :param calendar_id: The id of the calendar
+        :return: None
+        """
+        self._push(calendar_id, time.time())
+
+    def _push(self, calendar_id: str, timestamp: float) -> None:
+        generation = self._generations.get(calendar_id, 0) + 1
+        self._generations[calendar_id] = generation
+        heapq.heappush(self._heap, (timestamp, generation, calendar_id))
+        # The new trigger may be earlier than the one being waited for
+        self._wakeup.set()
+
+    def _schedule_next(self, calendar_id: str, after: float) -> None:
+        event = self.get_index(calendar_id).after(after + self.lead)
+        if event is not None:
+            self._push(calendar_id, event.begin_ts - self.lead)
+
+    async def run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            # Drop stale triggers
+            while self._heap and self._heap[0][1] != self._generations[self._heap[0][2]]:
+                heapq.heappop(self._heap)
+
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            timestamp, _, cal_id = self._heap[0]
+            delay = timestamp - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            self._schedule_next(cal_id, timestamp)
+            self.logger.debug(f"Triggering calendar {cal_id}")
+            self.callback(cal_id)
@@ -0,0 +1,146 @@
+# Variables
+import config
+
+# Custom modules
+from live_session import LiveSession
+
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import typing
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posted_events (
+    calendar TEXT NOT NULL,
+    event TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    posted_at REAL NOT NULL,
+    PRIMARY KEY (calendar, event)
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    message_id INTEGER PRIMARY KEY,
+    calendar TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS check_ins (
+    message_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (message_id, user_id)
+);
+"""
+
+
+class SharedState:
+    """
+    The state shared by the shards of a deployment, in a SQLite database: the events posted by each calendar,
+    claimed atomically so that an event is only ever posted once, and the live sessions with their check-ins,
+    so that a calendar can be handed over to another shard.
+    The database is only used from a single thread, so that the event loop isn't blocked while it is locked.
+    """
+    def __init__(self, file: str = None, shard_id: int = 0, logger: logging.Logger = logging.getLogger("SharedState")):
+        """
+
+        :param file: The file of the database, defaults to config.SHARED_STATE_FILE
+        :param shard_id: The id of the shard of this process
+        :param logger: An optional logger
+        """
+        self.file = config.SHARED_STATE_FILE if file is None else file
+        self.shard_id = shard_id
+        self.logger = logger
+
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._db = sqlite3.connect(self.file, timeout=config.SHARED_STATE_TIMEOUT,
+                                   isolation_level=None, check_same_thread=False)
+        # Readers don't wait for the writers of the other shards
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        self._db.close()
+
+    async def _run(self, function: typing.Callable, *args) -> typing.Any:
+        return await asyncio.get_event_loop().run_in_executor(self._executor, function, *args)
+
+    def load(self, calendar_ids: typing.Iterable[str]) -> typing.Tuple[typing.Dict[str, str], typing.List[dict]]:
+        """
+        Reads the last events and the live sessions of calendars, at startup
+        :param calendar_ids: The ids of the calendars
+        :return: The key of the last event of each calendar, and the records of the live sessions of the calendars,
+        like those of the journal, with the ids of the users who checked-in under "reacted"
+        """
+        calendar_ids = set(calendar_ids)
+        last_events = dict()
+        # The bare column is taken from the row with the latest posted_at
+        for cal_id, uid, _ in self._db.execute("SELECT calendar, event, MAX(posted_at) FROM posted_events "
+                                               "GROUP BY calendar"):
+            if cal_id in calendar_ids:
+                last_events[cal_id] = uid
+        sessions = list()
+        rows = self._db.execute("SELECT message_id, calendar, record FROM sessions").fetchall()
+        for message_id, cal_id, record in rows:
+            if cal_id in calendar_ids:
+                reacted = {user_id for user_id, in self._db.execute(
+                    "SELECT user_id FROM check_ins WHERE message_id = ?", (message_id,))}
+                sessions.append(dict(json.loads(record), calendar=cal_id, reacted=reacted))
+        return last_events, sessions
+
+    def _claim_event(self, calendar_id: str, key: str) -> bool:
+        # A single statement, atomic even if another shard claims the same event at the same time
+        cursor = self._db.execute("INSERT OR IGNORE INTO posted_events (calendar, event, shard, posted_at) "
+                                  "VALUES (?, ?, ?, ?)", (calendar_id, key, self.shard_id, time.time()))
+        # Events which ended long ago can't be posted anymore
+        self._db.execute("DELETE FROM posted_events WHERE posted_at < ?",
+                         (time.time() - config.CALENDAR_WINDOW_FUTURE,))
+        return cursor.rowcount == 1
+
+    async def claim_event(self, calendar_id: str, key: str) -> bool:
+        """
+        Claims the posting of an event
+        :param calendar_id: The id of the calendar of the event
+        :param key: The key of the event
+        :return: Whether or not the event can be posted by this shard, False if it was already claimed
+        """
+        try:
+            return await self._run(self._claim_event, calendar_id, key)
+        except sqlite3.Error as e:
+            # Not posting is better than posting twice, the event is missed
+            self.logger.error(f"Couldn't claim event {key} of calendar {calendar_id}: {e}")
+            return False
+
+    def _execute(self, *statements: typing.Tuple[str, tuple]) -> None:
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            for statement, parameters in statements:
+                self._db.execute(statement, parameters)
+        except sqlite3.Error:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    async def _write(self, *statements: typing.Tuple[str, tuple]) -> None:
+        try:
+            await self._run(self._execute, *statements)
+        except sqlite3.Error as e:
+            self.logger.error(f"Couldn't write the shared state: {e}")
+
+    async def open_session(self, session: LiveSession) -> None:
+        await self._write(("INSERT OR REPLACE INTO sessions (message_id, calendar, shard, record) VALUES (?, ?, ?, ?)",
+                           (session.message_id, session.calendar_id, self.shard_id, json.dumps(session.to_dict()))))
+
+    async def update_session(self, session: LiveSession) -> None:
+        # Not inserted again if it was closed meanwhile
+        await self._write(("UPDATE sessions SET record = ? WHERE message_id = ?",
+                           (json.dumps(session.to_dict()), session.message_id)))
+
+    async def check_in(self, message_id: int, user_id: int) -> None:
+        await self._write(("INSERT OR IGNORE INTO check_ins (message_id, user_id) VALUES (?, ?)",
+                           (message_id, user_id)))
+
+    async def close_session(self, message_id: int) -> None:
+        await self._write(("DELETE FROM sessions WHERE message_id = ?", (message_id,)),
+                          ("DELETE FROM check_ins WHERE message_id = ?", (message_id,)))
@@ -0,0 +1,73 @@
+# Custom modules
+from event_index import EventIndex, EventRecord
+from persistence import write_atomic
+
+from array import array
+import struct
+import typing
+
+# magic, version, number of events, hash of the feed the events were parsed from, end of the window of the events
+HEADER = struct.Struct("<4sHI64sd")
+MAGIC = b"EVSN"
+VERSION = 3
+
+
+def write_snapshot(file: str, index: EventIndex, feed_hash: str = "", window_end: float = 0.) -> None:
+    """
+    Writes the events of a calendar to a compact binary file: the begin and end arrays,
+    then the lengths of the uid, name, location and version of each event and all of them at once
+    :param file: The file to write
+    :param index: The index of the calendar
+    :param feed_hash: The hash of the feed the events were parsed from
+    :param window_end: The epoch timestamp of the end of the window the events were parsed in
+    :return: None
+    """
+    strings = [(value or "").encode("utf-8")
+               for event in index.events
+               for value in (event.uid, event.name, event.location, event.version)]
+    lengths = array("I", map(len, strings))
+    write_atomic(file, b"".join((HEADER.pack(MAGIC, VERSION, len(index), feed_hash.encode("ascii"), window_end),
+                                 index.begins.tobytes(),
+                                 index.ends.tobytes(),
+                                 lengths.tobytes(),
+                                 *strings)))
+
+
+def read_snapshot(file: str) -> typing.Tuple[EventIndex, str, float]:
+    """
+    Reads the events of a calendar from a snapshot
+    :param file: The file to read
+    :return: The index of the calendar, the hash of the feed and the end of the window it was parsed in
+    :raises ValueError: If the file isn't a valid snapshot
+    :raises IOError: If the file can't be read
+    """
+    with open(file, "rb") as fd:
+        data = memoryview(fd.read())
+    try:
+        magic, version, count, feed_hash, window_end = HEADER.unpack_from(data)
+    except struct.error as e:
+        raise ValueError(f"Invalid snapshot {file}") from e
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Invalid snapshot {file}")
+
+    offset = HEADER.size
+    arrays = list()
+    for typecode, length in (("d", count), ("d", count), ("I", 4 * count)):
+        a = array(typecode)
+        size = a.itemsize * length
+        a.frombytes(data[offset:offset + size])
+        arrays.append(a)
+        offset += size
+    begins, ends, lengths = arrays
+    if sum(lengths) != len(data) - offset:
+        raise ValueError(f"Truncated snapshot {file}")
+
+    strings = list()
+    for length in lengths:
+        strings.append(str(data[offset:offset + length], "utf-8") or None)
+        offset += length
+
+    events = [EventRecord(strings[4 * i], strings[4 * i + 1], strings[4 * i + 2], begins[i], ends[i],
+                          strings[4 * i + 3] or "")
+              for i in range(count)]
+    return EventIndex(events), feed_hash.rstrip(b"\0").decode("ascii"), window_end
@@ -0,0 +1,110 @@
+# Variables
+import config
+
+import asyncio
+import json
+import logging
+import os
+import typing
+
+# username, last name, first name
+Identity = typing.Tuple[str, str, str]
+
+
+class StudentRegistry:
+    """
+    The students, indexed by their Discord id and by the calendars they are part of, reloaded when their file changes.
+    In the file, a student is [username, last name, first name], optionally followed by the list of the ids of
+    their calendars, a student without calendars is part of all of them.
+    """
+    def __init__(self,
+                 file: str,
+                 calendar_ids: typing.Iterable[str],
+                 logger: logging.Logger = logging.getLogger("Students")):
+        """
+
+        :param file: The file of the students
+        :param calendar_ids: The ids of all the calendars
+        :param logger: An optional logger
+        """
+        self.file = file
+        self.calendar_ids = list(calendar_ids)
+        self.logger = logger
+
+        self.students: typing.Dict[str, Identity] = dict()
+        # calendar_id : the ids of its students
+        self.rosters: typing.Dict[str, typing.Set[str]] = {cal_id: set() for cal_id in self.calendar_ids}
+        self._mtime: typing.Union[float, None] = None
+        self._task: typing.Union[asyncio.Task, None] = None
+
+        try:
+            self._swap(self._read())
+        except (IOError, json.JSONDecodeError, ValueError, TypeError) as e:
+            self.logger.error(f"Couldn't load the students: {e}")
+
+    def __len__(self) -> int:
+        return len(self.students)
+
+    def __contains__(self, _id: typing.Union[int, str]) -> bool:
+        return str(_id) in self.students
+
+    def get(self, _id: typing.Union[int, str]) -> typing.Union[Identity, None]:
+        return self.students.get(str(_id), None)
+
+    def is_member(self, _id: typing.Union[int, str], calendar_id: str) -> bool:
+        return str(_id) in self.rosters.get(calendar_id, ())
+
+    def roster_size(self, calendar_id: str) -> int:
+        return len(self.rosters.get(calendar_id, ()))
+
+    def _read(self) -> typing.Tuple[float, dict]:
+        mtime = os.stat(self.file).st_mtime
+        with open(self.file, "r", encoding="utf-8") as fd:
+            return mtime, json.load(fd)
+
+    def _swap(self, loaded: typing.Tuple[float, dict]) -> None:
+        """
+        Replaces the indexes as a whole, so that they are never seen half-built
+        :param loaded: The modification time and the content of the file
+        :return: None
+        :raises ValueError: If the content isn't an object of students, the previous ones are kept
+        """
+        mtime, raw = loaded
+        if not isinstance(raw, dict) or not all(isinstance(entry, list) for entry in raw.values()):
+            raise ValueError("The students must be an object of id : [username, last name, first name, calendars]")
+        students = dict()
+        rosters = {cal_id: set() for cal_id in self.calendar_ids}
+        for _id, entry in raw.items():
+            students[_id] = tuple(entry[:3])
+            for cal_id in (entry[3] if len(entry) > 3 else self.calendar_ids):
+                if cal_id in rosters:
+                    rosters[cal_id].add(_id)
+                else:
+                    self.logger.warning(f"Unknown calendar {cal_id} for student {_id}")
+        self.students, self.rosters, self._mtime = students, rosters, mtime
+        self.logger.info(f"Loaded {len(students)} student(s)")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._watch())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _watch(self) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(config.STUDENTS_RELOAD_INTERVAL)
+            try:
+                mtime = (await loop.run_in_executor(None, os.stat, self.file)).st_mtime
+            except OSError:
+                continue
+            if mtime == self._mtime:
+                continue
+            try:
+                self._swap(await loop.run_in_executor(None, self._read))
+            except (IOError, json.JSONDecodeError, ValueError, TypeError) as e:
+                # Most likely being written, it will be read again on the next check
+                self.logger.error(f"Couldn't reload the students: {e}")
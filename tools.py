@@ -1,14 +1,20 @@
 # Variables
 import config
 
+# Custom modules
+import http_client
+import metrics
+import persistence
+from event_index import EventRecord
+
+import asyncio
 import json
 import colorlog
 import discord
-from ics import Event
-import requests
 from logging import Logger
 import typing
 import argparse
+import time
 from os.path import join
 
 
@@ -24,19 +30,18 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--enable-check-in",
                         action="store_true",
                         help="to enable check-ins")
+    parser.add_argument("--shard-count",
+                        default=1,
+                        type=int,
+                        help="the number of shards the calendars are split between, each run in its own process")
+    parser.add_argument("--shard-id",
+                        default=None,
+                        type=int,
+                        help="the shard to run, all of them are run when omitted")
     args = parser.parse_args()
     return args
 
 
-def load_students(file: str) -> dict:
-    try:
-        with open(file, "r", encoding="utf-8") as fd:
-            s = json.load(fd)
-        return s
-    except (IOError, json.JSONDecodeError):
-        return dict()
-
-
 def load_calendars_config(file: str) -> dict:
     try:
         with open(file, "r", encoding="utf-8") as fd:
@@ -46,72 +51,170 @@ def load_calendars_config(file: str) -> dict:
         return dict()
 
 
-def get_student(_id: int, students: dict) -> typing.Union[list, None]:
-    return students.get(str(_id), None)
-
-
 def get_calendar_filename(calendar_id: str) -> str:
-    return join(config.CALENDARS_FOLDER, calendar_id + ".ics")
+    return join(config.CALENDARS_FOLDER, calendar_id + ".ics" + persistence.get_feed_extension())
 
 
 def get_calendar_data_filename(calendar_id: str) -> str:
     return join(config.CALENDARS_FOLDER, calendar_id + ".data.json")
 
 
-def generate_event_embed(event: Event,
+def get_calendar_snapshot_filename(calendar_id: str) -> str:
+    return join(config.CALENDARS_FOLDER, calendar_id + ".snapshot")
+
+
+def get_shard_filename(file: str, shard_id: typing.Union[int, None]) -> str:
+    """
+    Gets the file of a shard, for the files which can't be shared between several bots
+    :param file: The file, as configured
+    :param shard_id: The id of the shard, None if the bot isn't sharded
+    :return: The file of the shard
+    """
+    return file if shard_id is None else f"{file}.{shard_id}"
+
+
+def get_calendar_shard(calendar: dict, shard_count: int) -> int:
+    """
+    Gets the shard a calendar belongs to: the one receiving the events of the guild of its channel,
+    so that it gets the reactions to the messages of the calendar
+    :param calendar: The configuration of the calendar
+    :param shard_count: The number of shards
+    :return: The id of the shard
+    :raises ValueError: If the guild of the calendar isn't configured while the bot is sharded
+    """
+    if shard_count == 1:
+        return 0
+    if "guild_id" not in calendar:
+        # Any shard but the one of the guild would never get the reactions, and the check-ins would be lost
+        raise ValueError(f"The guild_id of calendar {calendar['id']} is required to run several shards")
+    # Same as Discord, see https://discord.com/developers/docs/topics/gateway#sharding
+    return (calendar["guild_id"] >> 22) % shard_count
+
+
+FOOTER_TEXT = "Ensi-pointing par Rom"
+FOOTER_ICON_URL = "https://camo.githubusercontent.com/" \
+                  "8bcee5987a3ce80d2d466bb1cbe5b5c18b6450f84036d98ef37" \
+                  "854eb120d5601/68747470733a2f2f66696c65732e636174626f" \
+                  "782e6d6f652f71753731656d2e6a7067"
+
+
+class EventEmbed:
+    """
+    Renders the embed of an event, everything but the check-in counter is computed once
+    """
+    __slots__ = ("title", "color", "thumbnail", "hours", "location")
+
+    @metrics.EMBED_RENDER_SECONDS.time(kind="static")
+    def __init__(self, event: EventRecord, calendar_data: dict):
+        """
+
+        :param event: The event to generate the embed for
+        :param calendar_data: The data for the calendar
+        """
+        self.title = event.name if event.name else "Unknow course"
+        self.color = int(calendar_data["embed"]["color"], 16)
+        self.thumbnail = calendar_data["embed"]["thumbnail"]
+        self.hours = f"De {event.begin.to(config.TIMEZONE).strftime('%Hh%M')}" \
+                     f" à {event.end.to(config.TIMEZONE).strftime('%Hh%M')}"
+        self.location = event.location if event.location else "Unknown location"
+
+    @metrics.EMBED_RENDER_SECONDS.time(kind="counter")
+    def render(self, check_in_number: typing.Tuple[int, int], finished: bool = False) -> discord.Embed:
+        """
+
+        :param check_in_number: A tuple with two elements, the number of check-ins, and the total number of users of the calendar
+        :param finished: Whether or not the event is finished
+        :return: The generated Embed object
+        """
+        description = config.EMBED_EVENT_DESCRIPTION if not finished else config.EMBED_EVENT_FINISHED_DESCRIPTION
+        embed = discord.Embed(title=self.title, description=description, color=self.color)
+        embed.set_thumbnail(url=self.thumbnail)
+        embed.add_field(name="Heure", value=self.hours, inline=True)
+        embed.add_field(name="Salle", value=self.location, inline=True)
+        embed.add_field(name="Pointage", value=f"{check_in_number[0]}/{check_in_number[1]}", inline=True)
+        embed.set_footer(text=FOOTER_TEXT, icon_url=FOOTER_ICON_URL)
+        return embed
+
+
+def generate_event_embed(event: EventRecord,
                          check_in_number: typing.Tuple[int, int],
                          calendar_data: dict,
                          finished: bool = False) -> discord.Embed:
     """
-
+    Renders the embed of an event once, use an EventEmbed to render it several times
     :param event: The event to generate the embed for
     :param check_in_number: A tuple with two elements, the number of check-ins, and the total number of users of the calendar
     :param calendar_data: The data for the calendar
     :param finished: Whether or not the event is finished
     :return: The generated Embed object
     """
-    description = config.EMBED_EVENT_DESCRIPTION if not finished else config.EMBED_EVENT_FINISHED_DESCRIPTION
-    name = event.name if event.name else "Unknow course"
-    location = event.location if event.location else "Unknown location"
-    embed = discord.Embed(title=name,
-                          description=description,
-                          color=int(calendar_data["embed"]["color"], 16))
-    embed.set_thumbnail(url=calendar_data["embed"]["thumbnail"])
-    embed.add_field(name="Heure", value=f"De {event.begin.to(config.TIMEZONE).strftime('%Hh%M')}"
-                                        f" à {event.end.to(config.TIMEZONE).strftime('%Hh%M')}", inline=True)
-    embed.add_field(name="Salle", value=location, inline=True)
-    embed.add_field(name="Pointage", value=f"{check_in_number[0]}/{check_in_number[1]}", inline=True)
-    embed.set_footer(text="Ensi-pointing par Rom", icon_url="https://camo.githubusercontent.com/"
-                                                            "8bcee5987a3ce80d2d466bb1cbe5b5c18b6450f84036d98ef37"
-                                                            "854eb120d5601/68747470733a2f2f66696c65732e636174626f"
-                                                            "782e6d6f652f71753731656d2e6a7067")
-    return embed
-
-
-def get_courses() -> list:
+    return EventEmbed(event, calendar_data).render(check_in_number, finished)
+
+
+async def get_courses(logger: Logger) -> list:
+    """
+    Gets the courses of the day from the API
+    :param logger: The logger
+    :return: The courses, empty if they couldn't be fetched
+    """
+    start = time.perf_counter()
+    outcome = "error"
     try:
-        r = requests.get(config.API_COURSES_ENDPOINT)
+        r = await http_client.get(config.API_COURSES_ENDPOINT, logger=logger)
         r.raise_for_status()
         j = r.json()
         s = j.get("success", False)
         if s:
-            return j["courses"]
-    except (requests.HTTPError, json.JSONDecodeError):
+            outcome = "success"
+            return list(j["courses"])
+        outcome = "refused"
+    except (http_client.HTTPError, json.JSONDecodeError):
         pass
+    except Exception as e:
+        # e.g. an unexpected response, handled like an unreachable API
+        logger.exception(f"Unexpected error while getting the courses: {e}")
+    finally:
+        metrics.COURSES_API_SECONDS.observe(time.perf_counter() - start, outcome=outcome)
     return list()
 
 
-def filter_current_courses(event: Event, courses: list) -> list:
-    current_courses = list()
-    for course in courses:
-        evt_start = event.begin.to("Europe/Paris").strftime("%H:%M")
-        evt_end = event.end.to("Europe/Paris").strftime("%H:%M")
-        if course["start"] == evt_start and course["end"] == evt_end:
-            current_courses.append(course)
-    return current_courses
+async def is_api_reachable(logger: Logger) -> bool:
+    """
+    Checks that the API answers, without retrying and within config.API_PROBE_TIMEOUT seconds
+    :param logger: The logger
+    :return: Whether or not the API answered without a server error
+    """
+    try:
+        r = await asyncio.wait_for(http_client.get(config.API_BASE_URL, retries=0, logger=logger),
+                                   config.API_PROBE_TIMEOUT)
+        return r.status < 500
+    except (http_client.HTTPError, asyncio.TimeoutError) as e:
+        logger.debug(f"The API couldn't be reached: {e!r}")
+        return False
+
+
+def get_event_slot(event: EventRecord) -> typing.Tuple[str, str]:
+    """
+    Gets the time slot of an event, formatted like the start and end of the courses
+    :param event: The calendar event
+    :return: The start and end of the event
+    """
+    return event.begin.to(config.TIMEZONE).strftime("%H:%M"), event.end.to(config.TIMEZONE).strftime("%H:%M")
+
+
+def _is_transient(error: http_client.HTTPError) -> bool:
+    return error.status is None or error.status in http_client.RETRY_STATUSES
 
 
-def check_in(username: str, course_id: int, logger: Logger) -> bool:
+async def check_in(username: str, course_id: int, logger: Logger, retries: int = None) -> typing.Union[bool, None]:
+    """
+
+    :param username: The username of the student
+    :param course_id: The id of the course
+    :param logger: The logger
+    :param retries: The number of HTTP retries, defaults to config.HTTP_RETRIES
+    :return: Whether or not the student was checked-in, None if the API couldn't be reached and it may be retried
+    """
     payload = {
         "courseID": str(course_id),
         "username": username
@@ -119,17 +222,60 @@ def check_in(username: str, course_id: int, logger: Logger) -> bool:
     headers = {
         "Content-Type": "application/json"
     }
+    start = time.perf_counter()
+    s = None
     try:
-        r = requests.post(config.API_CHECK_IN_ENDPOINT, headers=headers, data=json.dumps(payload))
-        logger.debug(f"POST to check_in, status code: {r.status_code}")
+        r = await http_client.post(config.API_CHECK_IN_ENDPOINT, headers=headers, data=json.dumps(payload),
+                                   retries=retries, logger=logger)
+        logger.debug(f"POST to check_in, status code: {r.status}")
         logger.debug(r.text)
         r.raise_for_status()
         j: dict = r.json()
         s = j.get("success", False)
-        return s
-    except (requests.HTTPError, json.JSONDecodeError):
+    except http_client.HTTPError as e:
+        s = None if _is_transient(e) else False
+    except json.JSONDecodeError:
+        pass
+    finally:
+        outcome = {True: "success", False: "refused", None: "error"}.get(s, "refused")
+        metrics.CHECK_IN_API_SECONDS.observe(time.perf_counter() - start, outcome=outcome)
+    return s
+
+
+async def check_in_batch(entries: typing.List[typing.Tuple[str, int]],
+                         logger: Logger,
+                         retries: int = None) -> typing.Union[typing.List[bool], None]:
+    """
+    Checks-in several students at once with the batch endpoint
+    :param entries: The (username, course id) pairs to check-in
+    :param logger: The logger
+    :param retries: The number of HTTP retries, defaults to config.HTTP_RETRIES
+    :return: Whether or not each student was checked-in, in the same order, None if the API couldn't be reached
+    """
+    payload = {
+        "check_ins": [{"courseID": str(course_id), "username": username} for username, course_id in entries]
+    }
+    headers = {
+        "Content-Type": "application/json"
+    }
+    start = time.perf_counter()
+    try:
+        r = await http_client.post(config.API_CHECK_IN_BATCH_ENDPOINT, headers=headers, data=json.dumps(payload),
+                                   retries=retries, logger=logger)
+        metrics.CHECK_IN_API_SECONDS.observe(time.perf_counter() - start, outcome="batch")
+        logger.debug(f"POST to check_in batch of {len(entries)}, status code: {r.status}")
+        r.raise_for_status()
+        j: dict = r.json()
+        results = j.get("results", list())
+        if len(results) == len(entries):
+            return [bool(result.get("success", False)) for result in results]
+        logger.error(f"Got {len(results)} result(s) for a batch of {len(entries)} check-in(s)")
+    except http_client.HTTPError as e:
+        if not _is_transient(e):
+            return [False] * len(entries)
+    except json.JSONDecodeError:
         pass
-    return False
+    return None
 
 
 def get_logger(name: str = str(), level: str = "ERROR") -> Logger: